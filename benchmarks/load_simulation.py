@@ -0,0 +1,316 @@
+"""Simulazione di carico del bot con Discord e yt-dlp finti.
+
+Guida MusicCommands attraverso N guild simulate (play, playlist, coda, skip)
+e riporta tempo al primo audio, pausa tra i brani, modifiche ai messaggi al
+minuto, ritardo dell'event loop e picco di memoria.
+
+Uso:
+    python benchmarks/load_simulation.py --guilds 50 --extract-latency 0.8
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import asynccontextmanager
+
+# Nessuna cache su disco durante la simulazione
+os.environ.setdefault("CACHE_DB_PATH", "")
+os.environ.setdefault("QUEUE_STATE_DIR", "")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import extraction_service  # noqa: E402
+import ytdl_source  # noqa: E402
+from commands import MusicCommands  # noqa: E402
+from player_registry import music_players  # noqa: E402
+
+
+class Stats:
+    def __init__(self):
+        self.requested_at = {}  # guild_id -> istante del primo comando
+        self.first_audio = []
+        self.track_ended_at = {}  # guild_id -> fine dell'ultimo brano
+        self.gaps = []
+        self.plays = 0
+        self.extractions = 0
+        self.sends = 0
+        self.edits = 0
+        self.loop_lag = []
+
+
+stats = Stats()
+
+
+class FakeYoutubeDL:
+    """Sostituto di yt_dlp.YoutubeDL con latenza configurabile"""
+
+    def __init__(self, latency, track_duration, playlist_size):
+        self.latency = latency
+        self.track_duration = track_duration
+        self.playlist_size = playlist_size
+
+    def _info(self, video_id):
+        return {
+            "id": video_id,
+            "webpage_url": f"https://www.youtube.com/watch?v={video_id}",
+            "url": f"https://rr.googlevideo.com/videoplayback?expire={int(time.time()) + 21600}&id={video_id}",
+            "title": f"Track {video_id}",
+            "thumbnail": None,
+            "duration": self.track_duration,
+            "acodec": "opus",
+            "http_headers": {},
+        }
+
+    def extract_info(self, query, download=False, process=True):
+        stats.extractions += 1
+        time.sleep(self.latency)
+
+        if "list=" in query:
+            entries = (
+                {
+                    "_type": "url",
+                    "id": f"{abs(hash(query)) % 10000}-{i}",
+                    "url": f"https://www.youtube.com/watch?v={abs(hash(query)) % 10000}-{i}",
+                    "title": f"Playlist track {i}",
+                    "duration": self.track_duration,
+                }
+                for i in range(self.playlist_size)
+            )
+            return {"_type": "playlist", "entries": entries if not process else list(entries)}
+
+        if query.startswith("ytsearch:"):
+            return {"entries": [self._info(query[len("ytsearch:"):].replace(" ", "_"))]}
+        return self._info(query.rsplit("=", 1)[-1])
+
+
+class FakeSource:
+    def __init__(self, song_info, offset=0):
+        self.data = song_info
+        self.duration = song_info.get("duration", 0)
+        self.offset = offset
+        self.started_at = None
+        self.time_scale = 1
+
+    @property
+    def position(self):
+        # Secondi simulati trascorsi da quando la sorgente è in riproduzione
+        if self.started_at is None:
+            return self.offset
+        return self.offset + (time.perf_counter() - self.started_at) / self.time_scale
+
+    def cleanup(self):
+        pass
+
+
+class FakeMessage:
+    def __init__(self, channel):
+        self.channel = channel
+
+    async def edit(self, **kwargs):
+        stats.edits += 1
+        await asyncio.sleep(0.05)
+
+
+class FakeMember:
+    bot = False
+
+
+class FakeChannel:
+    def __init__(self, guild_id, loop, time_scale):
+        self.id = guild_id
+        self.members = [FakeMember()]
+        self.loop = loop
+        self.time_scale = time_scale
+
+    async def connect(self):
+        return FakeVoiceClient(self)
+
+
+class FakeVoiceClient:
+    """Simula la riproduzione: il callback `after` arriva da un altro thread"""
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.guild_id = channel.id
+        self._timer = None
+        self._after = None
+        self._paused = False
+
+    def is_connected(self):
+        return True
+
+    def is_playing(self):
+        return self._timer is not None and not self._paused
+
+    def is_paused(self):
+        return self._timer is not None and self._paused
+
+    def play(self, source, *, after=None):
+        if self._timer is not None:
+            raise RuntimeError("Already playing audio.")
+
+        now = time.perf_counter()
+        stats.plays += 1
+        if self.guild_id in stats.requested_at:
+            stats.first_audio.append(now - stats.requested_at.pop(self.guild_id))
+        if self.guild_id in stats.track_ended_at:
+            stats.gaps.append(now - stats.track_ended_at.pop(self.guild_id))
+
+        self._after = after
+        source.started_at = now
+        source.time_scale = self.channel.time_scale
+        self._timer = threading.Timer(
+            (source.duration - source.offset) * self.channel.time_scale, self._finish
+        )
+        self._timer.start()
+
+    def _finish(self, error=None):
+        after, self._after, self._timer = self._after, None, None
+        stats.track_ended_at[self.guild_id] = time.perf_counter()
+        if after:
+            after(error)
+
+    def pause(self):
+        self._paused = True
+
+    def resume(self):
+        self._paused = False
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._finish()
+        # Uno skip non è una pausa tra brani
+        stats.track_ended_at.pop(self.guild_id, None)
+
+    async def disconnect(self):
+        self.stop()
+
+
+class FakeContext:
+    def __init__(self, guild_id, channel):
+        self.guild = type("Guild", (), {"id": guild_id})()
+        self.author = type("Author", (), {"voice": type("Voice", (), {"channel": channel})()})()
+        self.channel = channel
+
+    async def send(self, *args, **kwargs):
+        stats.sends += 1
+        return FakeMessage(self.channel)
+
+    @asynccontextmanager
+    async def typing(self):
+        yield
+
+
+class FakeBot:
+    def __init__(self, loop):
+        self.loop = loop
+        self.user = object()
+        self.presence_updates = 0
+
+    async def change_presence(self, **kwargs):
+        self.presence_updates += 1
+
+
+async def monitor_loop_lag(interval=0.05):
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        stats.loop_lag.append(time.perf_counter() - start - interval)
+
+
+async def simulate_guild(cog, guild_id, args, loop):
+    channel = FakeChannel(guild_id, loop, args.time_scale)
+    ctx = FakeContext(guild_id, channel)
+
+    stats.requested_at[guild_id] = time.perf_counter()
+    await cog.play_command.callback(cog, ctx, url=f"song {guild_id % args.distinct_songs}")
+    await cog.play_command.callback(
+        cog, ctx, url=f"https://www.youtube.com/playlist?list=PL{guild_id % args.distinct_songs}"
+    )
+
+    for _ in range(args.skips):
+        await asyncio.sleep(args.track_duration * args.time_scale / 2)
+        await cog.queue.callback(cog, ctx)
+        await cog.skip.callback(cog, ctx)
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def report(label, values, unit="ms", scale=1000):
+    if not values:
+        print(f"{label:<28} n/a")
+        return
+    print(
+        f"{label:<28} p50 {statistics.median(values) * scale:8.1f}{unit}"
+        f"  p95 {percentile(values, 0.95) * scale:8.1f}{unit}"
+        f"  max {max(values) * scale:8.1f}{unit}"
+    )
+
+
+async def main(args):
+    loop = asyncio.get_running_loop()
+
+    fake = FakeYoutubeDL(args.extract_latency, args.track_duration, args.playlist_size)
+    extraction_service.get_ytdl = lambda profile="default": fake
+    ytdl_source.get_ytdl = extraction_service.get_ytdl
+    ytdl_source.YTDLSource.from_resolved = classmethod(
+        lambda cls, song_info, offset=0, **kwargs: FakeSource(song_info, offset)
+    )
+
+    bot = FakeBot(loop)
+    cog = MusicCommands(bot)
+
+    tracemalloc.start()
+    lag_task = asyncio.create_task(monitor_loop_lag())
+    start = time.perf_counter()
+
+    await asyncio.gather(
+        *(simulate_guild(cog, guild_id, args, loop) for guild_id in range(args.guilds))
+    )
+    await asyncio.sleep(args.settle)
+
+    elapsed = time.perf_counter() - start
+    lag_task.cancel()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"Guild simulate:              {args.guilds}")
+    print(f"Durata:                      {elapsed:.1f}s")
+    print(f"Brani avviati:               {stats.plays}")
+    print(f"Estrazioni yt-dlp:           {stats.extractions}")
+    print(f"Messaggi inviati:            {stats.sends}")
+    print(f"Modifiche al minuto:         {stats.edits / elapsed * 60:.0f}")
+    print(f"Aggiornamenti presenza:      {bot.presence_updates}")
+    print(f"Player attivi:               {len(music_players)}")
+    report("Tempo al primo audio", stats.first_audio)
+    report("Pausa tra i brani", stats.gaps)
+    report("Ritardo event loop", stats.loop_lag)
+    print(f"Picco memoria:               {peak / 1024 / 1024:.1f} MiB")
+
+    for player in music_players.values():
+        if player.controller:
+            await player.controller.stop()
+    extraction_service.extraction_service.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--extract-latency", type=float, default=0.5, help="secondi per estrazione")
+    parser.add_argument("--track-duration", type=int, default=30, help="secondi (simulati)")
+    parser.add_argument("--time-scale", type=float, default=0.1, help="secondi reali per secondo simulato")
+    parser.add_argument("--playlist-size", type=int, default=200)
+    parser.add_argument("--distinct-songs", type=int, default=5, help="canzoni diverse richieste")
+    parser.add_argument("--skips", type=int, default=3)
+    parser.add_argument("--settle", type=float, default=5.0, help="secondi di osservazione finale")
+    asyncio.run(main(parser.parse_args()))
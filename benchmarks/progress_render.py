@@ -0,0 +1,134 @@
+"""Micro-benchmark del rendering del progresso.
+
+Simula N player in riproduzione e, a ogni tick, fa avanzare la posizione,
+renderizza il progresso e costruisce l'embed solo se il rendering è
+cambiato. Confronta il costo per player con il rendering precedente
+(strftime e nuovo embed a ogni tick).
+
+Uso:
+    python benchmarks/progress_render.py --players 5000 --ticks 20
+"""
+
+import argparse
+import os
+import sys
+import time
+
+os.environ.setdefault("CACHE_DB_PATH", "")
+os.environ.setdefault("QUEUE_STATE_DIR", "")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import discord  # noqa: E402
+from music_player import MusicPlayer  # noqa: E402
+from progress_renderer import ProgressRenderer, UNCHANGED  # noqa: E402
+from track import Track  # noqa: E402
+
+BAR_LENGTH = 25
+
+
+class FakeVoiceClient:
+    def is_paused(self):
+        return False
+
+
+class FakeSource:
+    def __init__(self, position):
+        self.position = position
+
+
+def make_players(count):
+    players = []
+    for index in range(count):
+        duration = 120 + index % 3600  # anche brani oltre l'ora
+        song = Track(
+            f"https://www.youtube.com/watch?v={index}",
+            title=f"Canzone {index}",
+            id=str(index),
+            duration=duration,
+        )
+        player = MusicPlayer(index)
+        player.voice_client = FakeVoiceClient()
+        player.current_song = song
+        player.current_duration = duration
+        player.source = FakeSource(index % duration)
+        player.progress_renderer = ProgressRenderer(song, duration)
+        players.append(player)
+    return players
+
+
+def legacy_render(player):
+    """Rendering precedente: strftime per ogni tempo e barra ricostruita"""
+    duration = player.current_duration
+    elapsed = player.get_position()
+    percent = min(elapsed / duration * 100, 100)
+    fmt = "%H:%M:%S" if duration >= 3600 else "%M:%S"
+    time_str = (
+        f"{time.strftime(fmt, time.gmtime(elapsed))} / "
+        f"{time.strftime(fmt, time.gmtime(duration))}"
+    )
+    filled = int(percent / 100 * BAR_LENGTH)
+    bar = "━" * filled + "◉" + "━" * (BAR_LENGTH - filled - 1)
+    if filled >= BAR_LENGTH:
+        bar = "━" * (BAR_LENGTH - 1) + "◉"
+    return player._progress_status(), f"{bar} {time_str}"
+
+
+def legacy_embed(player, render):
+    embed = discord.Embed(
+        title="🎵 Now Playing",
+        description=f"**{player.current_song['title']}**",
+        color=0x1DB954,
+    )
+    if player.current_song.get("thumbnail"):
+        embed.set_thumbnail(url=player.current_song["thumbnail"])
+    name, bar = render
+    embed.add_field(name=name, value=f"```{bar}```", inline=False)
+    return embed
+
+
+def run(players, ticks, step, tick_fn):
+    start = time.perf_counter()
+    changed = 0
+    for _ in range(ticks):
+        for player in players:
+            player.source.position += step
+            changed += tick_fn(player)
+    return time.perf_counter() - start, changed
+
+
+def current_tick(player):
+    render = player.render_progress()
+    if render is UNCHANGED:
+        return 0
+    player.create_progress_embed(render).to_dict()
+    player.progress_renderer.sent = render
+    return 1
+
+
+def legacy_tick(player):
+    render = legacy_render(player)
+    if render == player.progress_renderer.sent:
+        return 0
+    legacy_embed(player, render).to_dict()
+    player.progress_renderer.sent = render
+    return 1
+
+
+def main(args):
+    for label, tick_fn in (("Precedente", legacy_tick), ("Precalcolato", current_tick)):
+        players = make_players(args.players)
+        seconds, changed = run(players, args.ticks, args.step, tick_fn)
+        calls = args.players * args.ticks
+        print(
+            f"{label:<14} {seconds / calls * 1e6:7.2f}µs per player/tick  "
+            f"{seconds / args.ticks * 1000:8.2f}ms per tick  "
+            f"embed ricostruiti {changed / calls:6.1%}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--players", type=int, default=5000)
+    parser.add_argument("--ticks", type=int, default=20)
+    parser.add_argument("--step", type=float, default=0.25, help="secondi simulati per tick")
+    main(parser.parse_args())
@@ -0,0 +1,105 @@
+"""Benchmark dell'avvio del bot.
+
+Misura in processi Python nuovi il tempo di import di `main` e di
+creazione del bot (fino al punto in cui partirebbe il login), riporta i
+moduli più lenti secondo `-X importtime` e il costo del caricamento di
+yt-dlp, che avviene dopo il login.
+
+Uso:
+    python benchmarks/startup.py --runs 5 --top 15
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+# Eseguito in ogni processo misurato: stampa i tempi in secondi
+PROBE = """
+import time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+main.create_bot()
+created = time.perf_counter()
+loaded_before = "yt_dlp" in __import__("sys").modules
+from extraction_service import get_ytdl
+get_ytdl("default")
+warmed = time.perf_counter()
+print(imported - start, created - imported, warmed - created, int(loaded_before))
+"""
+
+
+def run_probe(env):
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE],
+        cwd=SRC,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    values = result.stdout.split()
+    return [float(v) for v in values[:3]], values[3] == "1"
+
+
+def import_times(env, top):
+    """Moduli con il tempo di import cumulativo più alto (ms)"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=SRC,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append((int(cumulative_us) / 1000, int(self_us) / 1000, name.rstrip()))
+    return sorted(modules, reverse=True)[:top]
+
+
+def main(args):
+    env = {
+        **os.environ,
+        "DISCORD_TOKEN": os.environ.get("DISCORD_TOKEN", "benchmark"),
+        "CACHE_DB_PATH": "",
+        "QUEUE_STATE_DIR": "",
+    }
+
+    samples = []
+    loaded_before = False
+    for _ in range(args.runs):
+        times, loaded = run_probe(env)
+        samples.append(times)
+        loaded_before = loaded_before or loaded
+
+    print(f"{'Esecuzioni':<32} {args.runs}")
+    for index, label in enumerate(
+        ("Import di main", "Creazione del bot", "Caricamento yt-dlp (post login)")
+    ):
+        values = [sample[index] * 1000 for sample in samples]
+        print(
+            f"{label:<32} mediana {statistics.median(values):7.1f}ms"
+            f"  min {min(values):7.1f}ms"
+        )
+    label = "yt-dlp importato all'avvio"
+    print(f"{label:<32} {'sì' if loaded_before else 'no'}")
+
+    print(f"\nModuli più lenti da importare (top {args.top}):")
+    print(f"{'cumulativo':>12} {'proprio':>10}  modulo")
+    for cumulative, own, name in import_times(env, args.top):
+        print(f"{cumulative:10.1f}ms {own:8.1f}ms  {name}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="moduli da mostrare")
+    main(parser.parse_args())
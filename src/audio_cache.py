@@ -0,0 +1,178 @@
+import asyncio
+import hashlib
+import os
+import re
+from collections import OrderedDict
+
+from config import (
+    AUDIO_CACHE_DIR,
+    AUDIO_CACHE_MAX_MB,
+    AUDIO_CACHE_MIN_PLAYS,
+    AUDIO_CACHE_MAX_DURATION,
+    AUDIO_CACHE_MAX_TRACKED,
+)
+
+SAFE_ID = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+
+class AudioCache:
+    """Cache su disco di file Opus per i brani riprodotti più spesso.
+
+    I file sono indicizzati per ID del video, l'ordine LRU è dato dalla data
+    di modifica (aggiornata a ogni lettura) e il riempimento avviene in
+    background dopo AUDIO_CACHE_MIN_PLAYS riproduzioni. La scansione della
+    cartella per l'eviction gira in un thread, fuori dall'event loop.
+    """
+
+    def __init__(
+        self,
+        directory=AUDIO_CACHE_DIR,
+        max_bytes=AUDIO_CACHE_MAX_MB * 1024 * 1024,
+        min_plays=AUDIO_CACHE_MIN_PLAYS,
+        max_duration=AUDIO_CACHE_MAX_DURATION,
+        max_tracked=AUDIO_CACHE_MAX_TRACKED,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.min_plays = min_plays
+        self.max_duration = max_duration
+        self.max_tracked = max_tracked
+        self.play_counts = OrderedDict()  # video_id -> riproduzioni, LRU
+        self.filling = set()
+        self.files = 0  # file e byte in cache all'ultima scansione
+        self.bytes = 0
+        self._fill_lock = None  # un solo riempimento alla volta
+
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    def path_for(self, video_id):
+        # L'ID viene dai dati dell'estrattore: se non è un ID semplice si usa l'hash
+        if not SAFE_ID.fullmatch(video_id):
+            video_id = hashlib.sha1(video_id.encode()).hexdigest()
+        return os.path.join(self.directory, f"{video_id}.opus")
+
+    def contains(self, video_id):
+        """Controlla se il brano è in cache senza aggiornarne l'uso"""
+        if not self.enabled or not video_id:
+            return False
+        return os.path.exists(self.path_for(video_id))
+
+    def lookup(self, video_id):
+        """Restituisce il percorso del file in cache, segnandolo come usato"""
+        if not self.contains(video_id):
+            return None
+
+        path = self.path_for(video_id)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def record_play(self, song):
+        """Conta una riproduzione e avvia il riempimento oltre la soglia"""
+        video_id = song.get("id")
+        if not self.enabled or not video_id or self.contains(video_id):
+            return
+
+        self.play_counts[video_id] = self.play_counts.get(video_id, 0) + 1
+        self.play_counts.move_to_end(video_id)
+        while len(self.play_counts) > self.max_tracked:
+            self.play_counts.popitem(last=False)
+        if (
+            self.play_counts[video_id] >= self.min_plays
+            and video_id not in self.filling
+            and song.get("stream_url")
+            and 0 < (song.get("duration") or 0) <= self.max_duration
+        ):
+            self.filling.add(video_id)
+            asyncio.create_task(self._fill(song))
+
+    async def _fill(self, song):
+        """Scarica e converte il brano in Opus nella cartella della cache"""
+        video_id = song["id"]
+        path = self.path_for(video_id)
+        partial = f"{path}.part"
+
+        if self._fill_lock is None:
+            self._fill_lock = asyncio.Lock()
+
+        args = ["ffmpeg", "-nostdin", "-loglevel", "error", "-y"]
+        if song.get("http_headers"):
+            headers = "".join(f"{k}: {v}\r\n" for k, v in song["http_headers"].items())
+            args += ["-headers", headers]
+        args += ["-i", song["stream_url"], "-vn", "-f", "opus"]
+        # Gli stream già Opus vengono solo rimpacchettati
+        if song.get("acodec") == "opus":
+            args += ["-c:a", "copy"]
+        else:
+            args += ["-c:a", "libopus", "-b:a", "128k", "-ar", "48000", "-ac", "2"]
+        args.append(partial)
+
+        try:
+            async with self._fill_lock:
+                process = await asyncio.create_subprocess_exec(
+                    *args,
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.PIPE,
+                )
+                _, stderr = await process.communicate()
+
+            if process.returncode != 0:
+                raise Exception(stderr.decode(errors="ignore").strip())
+
+            os.replace(partial, path)
+            self.play_counts.pop(video_id, None)
+            await asyncio.get_running_loop().run_in_executor(None, self.evict)
+        except Exception as e:
+            print(f"Errore nel salvataggio in cache di {video_id}: {e}")
+            if os.path.exists(partial):
+                os.remove(partial)
+        finally:
+            self.filling.discard(video_id)
+
+    def evict(self):
+        """Elimina i file usati meno di recente oltre la dimensione massima.
+
+        Scansiona tutta la cartella: va eseguita in un thread.
+        """
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(".opus"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in files)
+        count = len(files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                count -= 1
+            except OSError:
+                pass
+        self.files, self.bytes = count, total
+
+    def stats(self):
+        """Statistiche della cache audio (file e byte dell'ultima eviction)"""
+        if not self.enabled:
+            return {"enabled": False}
+
+        return {
+            "enabled": True,
+            "files": self.files,
+            "bytes": self.bytes,
+            "tracked": len(self.play_counts),
+            "filling": len(self.filling),
+        }
+
+
+# Cache audio condivisa (disattivata se AUDIO_CACHE_DIR è vuoto)
+audio_cache = AudioCache()
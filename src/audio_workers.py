@@ -0,0 +1,349 @@
+import multiprocessing
+import shlex
+import subprocess
+import threading
+from collections import deque
+from itertools import count
+from multiprocessing.connection import wait
+
+import discord
+from config import (
+    AUDIO_WORKERS,
+    AUDIO_WORKER_BUFFER,
+    AUDIO_WORKER_BATCH,
+    AUDIO_WORKER_READ_TIMEOUT,
+)
+
+from metrics import metrics
+
+# Argomenti di uscita come discord.FFmpegOpusAudio
+OPUS_OUTPUT_ARGS = (
+    "-map_metadata", "-1",
+    "-f", "opus",
+    "-ar", "48000",
+    "-ac", "2",
+    "-b:a", "128k",
+    "-loglevel", "warning",
+    "-fec", "true",
+    "-packet_loss", "15",
+    "-blocksize", "8192",
+)
+
+
+class _WorkerJob:
+    """Nel worker: un FFmpeg che codifica in Opus e invia i pacchetti al bot.
+
+    Invia al massimo `credit` pacchetti non ancora consumati: il bot
+    restituisce crediti man mano che li riproduce, così in pausa il worker
+    si ferma invece di bufferizzare tutto il brano.
+    """
+
+    def __init__(self, job_id, source, before_options, options, codec, send, done, credit, batch):
+        self.job_id = job_id
+        self.args = ["ffmpeg", *shlex.split(before_options), "-i", source]
+        self.args += [*OPUS_OUTPUT_ARGS, "-c:a", codec, *shlex.split(options), "pipe:1"]
+        self.send = send
+        self.done = done  # chiamata a fine job
+        self.credit = credit
+        self.batch = batch
+        self.stopped = False
+        self.process = None
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def add_credit(self, frames):
+        with self._condition:
+            self.credit += frames
+            self._condition.notify()
+
+    def stop(self):
+        with self._condition:
+            self.stopped = True
+            self._condition.notify()
+        if self.process and self.process.poll() is None:
+            self.process.kill()
+
+    def _wait_credit(self):
+        with self._condition:
+            while self.credit <= 0 and not self.stopped:
+                self._condition.wait()
+            return not self.stopped
+
+    def _run(self):
+        from discord.oggparse import OggStream
+
+        error = None
+        try:
+            self.process = subprocess.Popen(
+                self.args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE
+            )
+            packets = []
+            for packet in OggStream(self.process.stdout).iter_packets():
+                if not self._wait_credit():
+                    break
+                packets.append(packet)
+                with self._condition:
+                    self.credit -= 1
+                    send_now = self.credit <= 0
+                if len(packets) >= self.batch or send_now:
+                    self.send(("frames", self.job_id, packets))
+                    packets = []
+            if packets and not self.stopped:
+                self.send(("frames", self.job_id, packets))
+        except Exception as e:
+            error = str(e)
+        finally:
+            if self.process and self.process.poll() is None:
+                self.process.kill()
+            if self.process:
+                self.process.wait()
+            if not self.stopped:
+                self.send(("end", self.job_id, error))
+            self.done(self.job_id)
+
+
+def _worker_main(conn, credit, batch):
+    """Processo worker: esegue i job ricevuti dal bot"""
+    jobs = {}
+    send_lock = threading.Lock()
+
+    def send(message):
+        with send_lock:
+            conn.send(message)
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        if message is None:
+            break
+
+        kind, job_id, *args = message
+        if kind == "start":
+            job = jobs[job_id] = _WorkerJob(
+                job_id, *args, send, lambda job_id: jobs.pop(job_id, None), credit, batch
+            )
+            job.start()
+        elif kind == "credit" and job_id in jobs:
+            jobs[job_id].add_credit(*args)
+        elif kind == "stop" and job_id in jobs:
+            jobs.pop(job_id).stop()
+
+    for job in list(jobs.values()):
+        job.stop()
+
+
+class WorkerStream:
+    """Lato bot di un job: buffer dei pacchetti Opus ricevuti dal worker"""
+
+    def __init__(self, worker, job_id, credit_batch, read_timeout):
+        self.worker = worker
+        self.job_id = job_id
+        self.credit_batch = credit_batch
+        self.read_timeout = read_timeout
+        self.packets = deque()
+        self.finished = False
+        self.error = None
+        self.closed = False
+        self._consumed = 0
+        self._condition = threading.Condition()
+
+    def feed(self, packets):
+        with self._condition:
+            self.packets.extend(packets)
+            self._condition.notify()
+
+    def finish(self, error=None):
+        with self._condition:
+            self.finished = True
+            self.error = error
+            self._condition.notify()
+
+    def read(self):
+        """Prossimo pacchetto Opus; b'' a fine brano (chiamata dal thread audio)"""
+        with self._condition:
+            if not self.packets and not self.finished:
+                self._condition.wait_for(
+                    lambda: self.packets or self.finished, self.read_timeout
+                )
+            if not self.packets:
+                if self.error:
+                    raise Exception(f"Worker audio: {self.error}")
+                return b""
+            packet = self.packets.popleft()
+
+        self._consumed += 1
+        if self._consumed >= self.credit_batch:
+            self.worker.send(("credit", self.job_id, self._consumed))
+            self._consumed = 0
+        return packet
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.worker.close_stream(self)
+
+
+class WorkerOpusAudio(discord.AudioSource):
+    """Sorgente discord.py che riproduce i pacchetti Opus prodotti da un worker"""
+
+    def __init__(self, source, *, before_options="", options="", codec="libopus", pool=None):
+        self._stream = (pool or audio_workers).open(source, before_options, options, codec)
+
+    def read(self):
+        return self._stream.read()
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        self._stream.close()
+
+
+class AudioWorker:
+    """Un processo worker e la pipe verso di esso"""
+
+    def __init__(self, context, credit, batch):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(child_conn, credit, batch),
+            name="musicbot-audio",
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.streams = {}
+        self._send_lock = threading.Lock()
+
+    def send(self, message):
+        try:
+            with self._send_lock:
+                self.conn.send(message)
+        except (OSError, ValueError):
+            pass
+
+    def close_stream(self, stream):
+        if self.streams.pop(stream.job_id, None) is not None:
+            self.send(("stop", stream.job_id))
+
+    def dispatch(self):
+        """Consegna un messaggio del worker; False se il worker è terminato"""
+        try:
+            kind, job_id, payload = self.conn.recv()
+        except (EOFError, OSError):
+            for stream in list(self.streams.values()):
+                stream.finish("processo terminato")
+            self.streams.clear()
+            return False
+
+        stream = self.streams.get(job_id)
+        if stream is None:
+            return True
+        if kind == "frames":
+            stream.feed(payload)
+        elif kind == "end":
+            self.streams.pop(job_id, None)
+            stream.finish(payload)
+        return True
+
+    def stop(self):
+        self.send(None)
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.kill()
+        self.conn.close()
+
+
+class AudioWorkerPool:
+    """Pool di processi che eseguono FFmpeg e il parsing Opus fuori dal bot.
+
+    Il bot riceve pacchetti Opus già pronti da inviare a Discord: nel processo
+    principale non resta né codifica né elaborazione PCM, così molti stream
+    simultanei non rallentano l'event loop e l'heartbeat del gateway.
+    """
+
+    def __init__(
+        self,
+        workers=AUDIO_WORKERS,
+        buffer=AUDIO_WORKER_BUFFER,
+        batch=AUDIO_WORKER_BATCH,
+        read_timeout=AUDIO_WORKER_READ_TIMEOUT,
+    ):
+        self.size = workers
+        self.buffer = buffer
+        self.batch = batch
+        self.read_timeout = read_timeout
+        self.workers = []
+        self.exits = 0  # worker terminati inaspettatamente
+        self._ids = count()
+        self._lock = threading.Lock()
+        self._context = multiprocessing.get_context("spawn")
+        self._receiver = None
+
+    def _ensure_workers(self):
+        # Avviati alla prima richiesta; i worker terminati vengono sostituiti qui
+        while len(self.workers) < self.size:
+            self.workers.append(AudioWorker(self._context, self.buffer, self.batch))
+
+        if self._receiver is None:
+            self._receiver = threading.Thread(
+                target=self._receive, name="audio-workers", daemon=True
+            )
+            self._receiver.start()
+
+    def _receive(self):
+        """Thread unico che legge i messaggi di tutti i worker"""
+        while True:
+            with self._lock:
+                connections = {worker.conn: worker for worker in self.workers}
+                if not connections:
+                    self._receiver = None
+                    return
+            # Timeout breve per includere i worker aggiunti nel frattempo
+            for conn in wait(list(connections), timeout=0.5):
+                worker = connections[conn]
+                if worker.dispatch():
+                    continue
+                with self._lock:
+                    if worker in self.workers:
+                        self.workers.remove(worker)
+                        self.exits += 1
+                        metrics.inc("audio_worker_exits_total")
+                        print("Worker audio terminato, verrà sostituito")
+
+    def open(self, source, before_options, options, codec):
+        """Avvia un job sul worker meno carico e restituisce il suo stream"""
+        with self._lock:
+            self._ensure_workers()
+            worker = min(self.workers, key=lambda w: len(w.streams))
+            job_id = next(self._ids)
+            stream = WorkerStream(
+                worker, job_id, max(self.buffer // 4, 1), self.read_timeout
+            )
+            worker.streams[job_id] = stream
+        worker.send(("start", job_id, source, before_options, options, codec))
+        return stream
+
+    def stats(self):
+        """Statistiche del pool"""
+        return {
+            "workers": len(self.workers),
+            "streams": sum(len(worker.streams) for worker in self.workers),
+            "exits": self.exits,
+        }
+
+    def shutdown(self):
+        with self._lock:
+            workers, self.workers = self.workers, []
+        for worker in workers:
+            worker.stop()
+
+
+# Pool condiviso da tutte le guild
+audio_workers = AudioWorkerPool()
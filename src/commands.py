@@ -1,18 +1,32 @@
 import asyncio
+import time
+
 from discord.ext import commands
+from config import MAX_VOLUME, SEARCH_RESULTS, SEARCH_PICK_TIMEOUT
 from ytdl_source import (
-    YTDLSource,
     extract_song_info,
     is_playlist_url,
-    extract_playlist_info,
+    iter_playlist_info,
+    resolve_stream,
+    search_candidates,
+    search_index,
+    track_cache,
 )
 
-from utils import get_music_player
+from idle_manager import IdleManager
+from metrics import metrics
+from playback_controller import PlaybackController
+from player_registry import get_music_player, player_registry
+from queue_journal import queue_journal
+from track import Track
+from utils import parse_timestamp, format_timestamp
 
 
 class MusicCommands(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        self.idle = IdleManager(self._disconnect)
+        self.searches = {}  # (guild_id, utente) -> (query, risultati, creata_il)
 
     @commands.command(name="play", aliases=["p"])
     async def play_command(self, ctx, *, url=None):
@@ -22,9 +36,19 @@ class MusicCommands(commands.Cog):
         else:
             if is_playlist_url(url):
                 await self.add_playlist(ctx, url)
+            elif url.startswith("!"):
+                # "!play !ricerca" ignora cache e indice e ripete la ricerca
+                await self.play(ctx, search=url[1:].strip(), force=True)
             else:
                 await self.play(ctx, search=url)
 
+    @commands.command(name="playnext", aliases=["pn"])
+    async def play_next(self, ctx, *, query=None):
+        """Riproduce una canzone subito dopo quella corrente"""
+        if not query:
+            return await ctx.send("Specifica cosa riprodurre!")
+        await self.play(ctx, search=query, front=True)
+
     @commands.command(name="pause")
     async def pause(self, ctx):
         """Mette in pausa la riproduzione"""
@@ -32,6 +56,7 @@ class MusicCommands(commands.Cog):
 
         if player.voice_client and player.voice_client.is_playing():
             player.voice_client.pause()
+            queue_journal.position(player)
             if player.current_song:
                 await player.update_bot_status(
                     self.bot, player.current_song["title"], is_paused=True
@@ -40,6 +65,7 @@ class MusicCommands(commands.Cog):
             # Ferma gli aggiornamenti di progresso della canzone corrente
             await self._start_auto_progress_updates(ctx, player)
             player.stop_progress_updates()
+            self.idle.evaluate(player)
         else:
             await ctx.send("Nulla in riproduzione!")
 
@@ -48,24 +74,47 @@ class MusicCommands(commands.Cog):
         """Salta la canzone corrente"""
         player = get_music_player(ctx.guild.id)
 
-        if player.voice_client and player.voice_client.is_playing():
-            player.voice_client.stop()
-            player.stop_progress_updates()
-            await self.play_next_song(ctx)
-        else:
+        if not player.voice_client or not await self._controller(player).skip(ctx):
             await ctx.send("Nessuna canzone in coda.")
 
+    @commands.command(name="seek")
+    async def seek(self, ctx, position=None):
+        """Salta a una posizione della canzone corrente (1:30, 90, +15, -10)"""
+        player = get_music_player(ctx.guild.id)
+
+        if not position:
+            return await ctx.send("Specifica una posizione! Es. `!seek 1:30` o `!seek +15`")
+
+        try:
+            seconds = parse_timestamp(position.lstrip("+-"))
+        except ValueError:
+            return await ctx.send("Posizione non valida! Usa `90`, `1:30`, `+15` o `-10`.")
+
+        # Spostamento relativo alla posizione attuale
+        if position[0] in "+-":
+            sign = 1 if position[0] == "+" else -1
+            seconds = player.get_position() + sign * seconds
+
+        if not player.voice_client:
+            return await ctx.send("Nulla in riproduzione!")
+
+        try:
+            reached = await self._controller(player).seek(ctx, seconds)
+        except Exception as e:
+            return await ctx.send(f"Errore: {str(e)}")
+
+        if reached is None:
+            await ctx.send("Nulla in riproduzione!")
+        else:
+            await ctx.send(f"⏩ Posizione: **{format_timestamp(reached)}**")
+
     @commands.command(name="stop")
     async def stop(self, ctx):
         """Ferma tutto"""
         player = get_music_player(ctx.guild.id)
 
         if player.voice_client:
-            player.clear_queue()
-            player.current_song = None
-            player.stop_progress_updates()
-            player.voice_client.stop()
-            await player.update_bot_status(self.bot)
+            await self._controller(player).stop(ctx)
         else:
             await ctx.send("Non connesso!")
 
@@ -75,11 +124,7 @@ class MusicCommands(commands.Cog):
         player = get_music_player(ctx.guild.id)
 
         if player.voice_client:
-            # Ferma tutti gli aggiornamenti prima di disconnettersi
-            player.stop_progress_updates()
-            await player.voice_client.disconnect()
-            player.cleanup()
-            await player.update_bot_status(self.bot)
+            await self._disconnect(player)
             await ctx.send("👋 Disconnesso")
         else:
             await ctx.send("Non connesso!")
@@ -103,6 +148,142 @@ class MusicCommands(commands.Cog):
         message += f"\n\n**Totale: {len(player.queue)} canzoni in coda**"
         await ctx.send(message)
 
+    @commands.command(name="search")
+    async def search(self, ctx, *, query=None):
+        """Cerca più risultati (prima quelli già noti) da scegliere con !pick"""
+        if not query:
+            return await ctx.send("Specifica cosa cercare!")
+
+        # Risultati dall'indice locale subito, senza chiamate di rete
+        await search_index.load()
+        results = [
+            await track_cache.get_song(song["url"]) or Track.from_dict(song)
+            for _, song in search_index.search(query, SEARCH_RESULTS)
+        ]
+        known = len(results)
+        message = await ctx.send(self._search_message(query, results, known, pending=True))
+
+        # Un'unica ricerca flat per tutti i candidati: nessuno stream risolto
+        try:
+            urls = {song["url"] for song in results}
+            for song in await search_candidates(query, SEARCH_RESULTS):
+                if song["url"] not in urls:
+                    results.append(song)
+        except Exception as e:
+            await ctx.send(f"Errore nella ricerca: {str(e)}")
+
+        now = time.monotonic()
+        self.searches = {
+            key: entry for key, entry in self.searches.items()
+            if now - entry[2] < SEARCH_PICK_TIMEOUT
+        }
+        if results:
+            self.searches[(ctx.guild.id, ctx.author.id)] = (query, results, now)
+            # Il primo risultato è la scelta più probabile: lo risolve in anticipo
+            asyncio.create_task(self._resolve_candidate(results[0]))
+        await message.edit(content=self._search_message(query, results, known))
+
+    @commands.command(name="pick")
+    async def pick(self, ctx, number: int = None):
+        """Riproduce un risultato dell'ultima !search"""
+        key = (ctx.guild.id, ctx.author.id)
+        entry = self.searches.get(key)
+        if entry is None or time.monotonic() - entry[2] >= SEARCH_PICK_TIMEOUT:
+            return await ctx.send("Nessuna ricerca recente! Usa `!search <ricerca>`.")
+
+        query, results, _ = entry
+        if number is None or not 1 <= number <= len(results):
+            return await ctx.send(f"Scegli un numero tra 1 e {len(results)}!")
+
+        del self.searches[key]
+        song = results[number - 1]
+        metrics.inc("search_picks_total", rank="1" if number == 1 else "other")
+        # La scelta vale anche per le prossime richieste con la stessa ricerca
+        search_index.add_track(query, song)
+        await self.play(ctx, song=song)
+
+    def _search_message(self, query, results, known, pending=False):
+        lines = []
+        for i, song in enumerate(results):
+            duration = format_timestamp(song["duration"]) if song.get("duration") else "?"
+            marker = " 💾" if i < known else ""
+            lines.append(f"{i + 1}. **{song['title']}** ({duration}){marker}")
+
+        if not results:
+            if pending:
+                return f"🔎 Ricerca di **{query}** su YouTube..."
+            return f"🔎 Nessun risultato per **{query}**."
+
+        message = f"🔎 **Risultati per** {query}:\n" + "\n".join(lines)
+        if pending:
+            message += "\n⏳ Ricerca su YouTube..."
+        else:
+            message += "\n\nUsa `!pick <numero>` per scegliere."
+        return message
+
+    async def _resolve_candidate(self, song):
+        """Risolve lo stream di un risultato prima che venga scelto"""
+        try:
+            await resolve_stream(song)
+        except Exception as e:
+            print(f"Errore nella risoluzione anticipata: {e}")
+
+    @commands.command(name="shuffle")
+    async def shuffle(self, ctx):
+        """Mescola la coda"""
+        player = get_music_player(ctx.guild.id)
+
+        if len(player.queue) < 2:
+            return await ctx.send("Non ci sono abbastanza canzoni in coda!")
+
+        player.shuffle_queue()
+        await ctx.send(f"🔀 **Coda mescolata!** {len(player.queue)} canzoni.")
+
+    @commands.command(name="move")
+    async def move(self, ctx, source: int = None, target: int = None):
+        """Sposta una canzone della coda in un'altra posizione"""
+        player = get_music_player(ctx.guild.id)
+
+        size = len(player.queue)
+        if source is None or target is None or not (1 <= source <= size and 1 <= target <= size):
+            return await ctx.send(f"Usa `!move <da> <a>` con posizioni tra 1 e {size}!")
+
+        song = player.move_in_queue(source - 1, target - 1)
+        await ctx.send(f"↕️ **{song['title']}** spostata in posizione {target}")
+
+    @commands.command(name="remove", aliases=["rm"])
+    async def remove(self, ctx, positions=None):
+        """Rimuove dalla coda una canzone o un intervallo (es. 3 o 3-7)"""
+        player = get_music_player(ctx.guild.id)
+
+        try:
+            first, _, last = (positions or "").partition("-")
+            start = int(first)
+            stop = int(last) if last else start
+        except ValueError:
+            return await ctx.send("Usa `!remove <posizione>` o `!remove <da>-<a>`!")
+
+        if not 1 <= start <= stop:
+            return await ctx.send("Intervallo non valido!")
+
+        removed = player.remove_from_queue(start - 1, stop)
+        if not removed:
+            return await ctx.send("Nessuna canzone in quelle posizioni!")
+        if len(removed) == 1:
+            await ctx.send(f"🗑️ **{removed[0]['title']}** rimossa dalla coda")
+        else:
+            await ctx.send(f"🗑️ Rimosse {len(removed)} canzoni dalla coda")
+
+    @commands.command(name="dedupe")
+    async def dedupe(self, ctx):
+        """Rimuove dalla coda le canzoni ripetute"""
+        player = get_music_player(ctx.guild.id)
+
+        removed = player.dedupe_queue()
+        if not removed:
+            return await ctx.send("Nessun duplicato in coda!")
+        await ctx.send(f"🧹 Rimossi {removed} duplicati dalla coda")
+
     @commands.command(name="clear")
     async def clear_queue(self, ctx):
         """Svuota la coda"""
@@ -115,21 +296,52 @@ class MusicCommands(commands.Cog):
         player.clear_queue()
         await ctx.send(f"🗑️ **Coda svuotata!** Rimosse {queue_size} canzoni.")
 
+    @commands.command(name="audio")
+    async def audio_mode(self, ctx, mode=None):
+        """Imposta la modalità audio della guild (opus, worker o pcm)"""
+        player = get_music_player(ctx.guild.id)
+
+        if mode is None:
+            return await ctx.send(f"🔊 Modalità audio: **{player.audio_mode}**")
+
+        mode = mode.lower()
+        if mode not in ("opus", "worker", "pcm"):
+            return await ctx.send("Modalità non valida! Usa `opus`, `worker` o `pcm`.")
+
+        player.set_audio_mode(mode)
+        await ctx.send(f"🔊 Modalità audio impostata su **{mode}** dal prossimo brano")
+
+    @commands.command(name="volume")
+    async def volume(self, ctx, percent: int = None):
+        """Imposta il volume della guild in percentuale"""
+        player = get_music_player(ctx.guild.id)
+
+        if percent is None:
+            return await ctx.send(f"🔊 Volume: **{round(player.volume * 100)}%**")
+
+        limit = round(MAX_VOLUME * 100)
+        if not 0 <= percent <= limit:
+            return await ctx.send(f"Il volume deve essere tra 0 e {limit}!")
+
+        if player.set_volume(percent / 100):
+            await ctx.send(f"🔊 Volume impostato al **{percent}%**")
+        else:
+            await ctx.send(f"🔊 Volume impostato al **{percent}%** dal prossimo brano")
+
     @commands.Cog.listener()
     async def on_voice_state_update(self, member, before, after):
-        """Gestisce eventi di cambiamento stato vocale per mantenere il progresso live"""
-        if member == self.bot.user:
-            return
-
-        # Se il bot è rimasto solo nel canale, ferma tutto
-        if before.channel and self.bot.user in before.channel.members:
-            if len([m for m in before.channel.members if not m.bot]) == 0:
-                player = get_music_player(before.channel.guild.id)
-                if player.voice_client:
-                    player.stop_progress_updates()
-                    await player.voice_client.disconnect()
-                    player.cleanup()
-                    await player.update_bot_status(self.bot)
+        """Rivaluta l'inattività della guild quando cambia lo stato vocale"""
+        player = player_registry.peek(member.guild.id)
+        if player and player.voice_client:
+            self.idle.evaluate(player)
+
+    async def _disconnect(self, player):
+        """Ferma riproduzione e aggiornamenti, disconnette il bot e rilascia il player"""
+        await self._controller(player).stop()
+        await player.voice_client.disconnect()
+        await player.update_bot_status(self.bot)
+        player_registry.release(player.guild_id)
+        queue_journal.discard(player.guild_id)
 
     async def _start_auto_progress_updates(self, ctx, player):
         """Metodo helper per avviare automaticamente gli aggiornamenti di progresso"""
@@ -144,144 +356,103 @@ class MusicCommands(commands.Cog):
         except Exception as e:
             print(f"Errore nell'avvio automatico del progresso: {e}")
 
-    async def play(self, ctx, *, search):
-        """Riproduce una canzone da YouTube"""
-
-        player = get_music_player(ctx.guild.id)
-
-        if not player.voice_client:
-            if ctx.author.voice:
-                player.voice_client = await ctx.author.voice.channel.connect()
-            else:
-                return await ctx.send("Devi essere in un canale vocale!")
-
-        async with ctx.typing():
-            try:
-                song_info = await extract_song_info(search)
-
-                if not player.voice_client.is_playing():
-                    source = await YTDLSource.from_url(
-                        song_info["url"], loop=self.bot.loop
-                    )
-                    player.voice_client.play(
-                        source,
-                        after=lambda e: asyncio.run_coroutine_threadsafe(
-                            self.play_next_song(ctx), self.bot.loop
-                        )
-                        if not e
-                        else print(f"Errore: {e}"),
-                    )
-
-                    player.start_song(song_info)
-                    await player.update_bot_status(self.bot, song_info["title"])
-
-                    # Avvia automaticamente il progresso live quando inizia una canzone
-                    await self._start_auto_progress_updates(ctx, player)
+    async def _connect(self, ctx, player):
+        """Entra nel canale vocale dell'autore, ripristinando la coda salvata"""
+        if player.voice_client:
+            return True
+        if not ctx.author.voice:
+            await ctx.send("Devi essere in un canale vocale!")
+            return False
+
+        player.voice_client = await ctx.author.voice.channel.connect()
+        await self._restore_queue(ctx, player)
+        return True
+
+    async def _restore_queue(self, ctx, player):
+        """Riprende coda e brano salvati prima di un riavvio, senza riestrarli"""
+        current, position, queue = queue_journal.restore(ctx.guild.id)
+        songs = ([current] if current else []) + queue
+        if not songs:
+            return
 
-                else:
-                    player.add_to_queue([song_info])
-                    await ctx.send(f"📝 **{song_info['title']}** aggiunto alla coda")
+        try:
+            await self._controller(player).play(
+                ctx, songs, offset=position if current else 0
+            )
+            await ctx.send(f"♻️ **Coda ripristinata:** {len(songs)} canzoni")
+        except Exception as e:
+            print(f"Errore nel ripristino della coda: {e}")
 
-            except Exception as e:
-                await ctx.send(f"Errore: {str(e)}")
+    def _controller(self, player):
+        """Restituisce il controller di riproduzione della guild, creandolo se serve"""
+        if player.controller is None:
+            player.controller = PlaybackController(
+                self.bot, player, on_state_change=self.idle.evaluate
+            )
+        return player.controller
 
-    async def play_next_song(self, ctx):
-        """Riproduce la prossima canzone nella coda"""
+    async def play(self, ctx, *, search=None, force=False, song=None, front=False):
+        """Riproduce una canzone da YouTube, da una ricerca o già scelta"""
 
         player = get_music_player(ctx.guild.id)
-        bot = self.bot
 
-        if not player.voice_client or not player.voice_client.is_connected():
-            await player.update_bot_status(bot)
+        if not await self._connect(ctx, player):
             return
 
-        next_song = player.get_next_song()
-        if next_song:
+        async with ctx.typing():
             try:
-                source = await YTDLSource.from_url(next_song["url"], loop=bot.loop)
-                player.voice_client.play(
-                    source,
-                    after=lambda e: asyncio.run_coroutine_threadsafe(
-                        self.play_next_song(ctx), bot.loop
-                    )
-                    if not e
-                    else print(f"Errore: {e}"),
-                )
+                song_info = song or await extract_song_info(search, force)
 
-                player.start_song(next_song)
-                await self._start_auto_progress_updates(ctx, player)
-                await player.update_bot_status(bot, next_song["title"])
+                started = await self._controller(player).play(ctx, [song_info], front=front)
+                if not started and front:
+                    await ctx.send(f"⏭️ **{song_info['title']}** sarà la prossima canzone")
+                elif not started:
+                    await ctx.send(f"📝 **{song_info['title']}** aggiunto alla coda")
 
             except Exception as e:
                 await ctx.send(f"Errore: {str(e)}")
-                await self.play_next_song(ctx)
-        else:
-            player.current_song = None
-            player.stop_progress_updates()
-            await player.update_bot_status(bot)
 
     async def add_playlist(self, ctx, url):
         """Aggiunge una playlist alla coda"""
 
         player = get_music_player(ctx.guild.id)
 
-        if not player.voice_client:
-            if ctx.author.voice:
-                player.voice_client = await ctx.author.voice.channel.connect()
-            else:
-                return await ctx.send("Devi essere in un canale vocale!")
+        if not await self._connect(ctx, player):
+            return
 
         async with ctx.typing():
             try:
-                # Estrae le informazioni della playlist
-                songs = await extract_playlist_info(url)
-
-                if not songs:
+                controller = self._controller(player)
+                first_song = None
+                total = 0
+
+                # Le canzoni arrivano a blocchi: la riproduzione parte subito
+                # con la prima, le altre vengono risolte quando si avvicinano
+                # alla testa della coda
+                async for songs in iter_playlist_info(url):
+                    started = await controller.play(ctx, songs)
+                    first_song = first_song or started
+                    total += len(songs)
+
+                if not total:
                     return await ctx.send("❌ Playlist vuota o non trovata!")
 
-                # Se non c'è nulla in riproduzione, inizia con la prima canzone
-                if not player.voice_client.is_playing():
-                    from ytdl_source import YTDLSource
-
-                    first_song = songs[0]
-                    remaining_songs = songs[1:]
-
-                    # Riproduce la prima canzone
-                    source = await YTDLSource.from_url(
-                        first_song["url"], loop=self.bot.loop
+                queued = total - 1 if first_song else total
+                if first_song is None:
+                    await ctx.send(
+                        f"📝 **Playlist aggiunta alla coda!**\n"
+                        f"🎵 {queued} canzoni aggiunte"
                     )
-                    player.voice_client.play(
-                        source,
-                        after=lambda e: asyncio.run_coroutine_threadsafe(
-                            self.play_next_song(ctx), self.bot.loop
-                        )
-                        if not e
-                        else print(f"Errore: {e}"),
+                elif queued:
+                    await ctx.send(
+                        f"🎵 **Playlist aggiunta!**\n"
+                        f"▶️ Ora in riproduzione: **{first_song['title']}**\n"
+                        f"📝 {queued} canzoni aggiunte alla coda"
                     )
-
-                    player.start_song(first_song)
-                    await player.update_bot_status(self.bot, first_song["title"])
-                    await self._start_auto_progress_updates(ctx, player)
-
-                    # Aggiunge le canzoni rimanenti alla coda
-                    if remaining_songs:
-                        player.add_to_queue(remaining_songs)
-                        await ctx.send(
-                            f"🎵 **Playlist aggiunta!**\n"
-                            f"▶️ Ora in riproduzione: **{first_song['title']}**\n"
-                            f"📝 {len(remaining_songs)} canzoni aggiunte alla coda"
-                        )
-                    else:
-                        await ctx.send(
-                            f"🎵 **Canzone dalla playlist ora in riproduzione:**\n"
-                            f"▶️ **{first_song['title']}**"
-                        )
                 else:
-                    # Aggiunge tutte le canzoni alla coda
-                    player.add_to_queue(songs)
                     await ctx.send(
-                        f"📝 **Playlist aggiunta alla coda!**\n"
-                        f"🎵 {len(songs)} canzoni aggiunte"
+                        f"🎵 **Canzone dalla playlist ora in riproduzione:**\n"
+                        f"▶️ **{first_song['title']}**"
                     )
 
             except Exception as e:
@@ -297,6 +468,7 @@ class MusicCommands(commands.Cog):
                 await player.update_bot_status(
                     self.bot, player.current_song["title"], is_paused=False
                 )
+            self.idle.evaluate(player)
 
         # Riavvia gli aggiornamenti di progresso della canzone corrente
         await self._start_auto_progress_updates(ctx, player)
@@ -8,6 +8,13 @@ load_dotenv()
 DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
 COMMAND_PREFIX = "!"
 
+# Sharding: vuoto = bot singolo, "auto" = AutoShardedBot, N = numero di shard
+SHARD_COUNT = os.getenv("SHARD_COUNT", "") or None
+if SHARD_COUNT and SHARD_COUNT != "auto":
+    SHARD_COUNT = int(SHARD_COUNT)
+SHARD_PROCESSES = int(os.getenv("SHARD_PROCESSES", "1"))  # processi worker con il supervisore
+SHARD_STABLE_UPTIME = 300  # secondi di attività dopo cui il backoff di riavvio si azzera
+
 # Configurazione yt-dlp
 YTDL_FORMAT_OPTIONS = {
     "format": "bestaudio/worst",
@@ -17,12 +24,83 @@ YTDL_FORMAT_OPTIONS = {
     "default_search": "auto",
 }
 
+# Pool dedicato alle estrazioni
+EXTRACTION_MODE = os.getenv("EXTRACTION_MODE", "thread")  # "thread" o "process"
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", "4"))
+EXTRACTION_MAX_PENDING = 64  # estrazioni distinte in attesa prima di rifiutare
+
 FFMPEG_OPTIONS = {
     "before_options": "-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5",
     "options": "-vn",
 }
 
+# Modalità audio predefinita per guild: "opus" (codifica in FFmpeg), "worker"
+# (FFmpeg e parsing Opus in processi separati) o "pcm"
+DEFAULT_AUDIO_MODE = os.getenv("AUDIO_MODE", "pcm")
+DEFAULT_VOLUME = float(os.getenv("DEFAULT_VOLUME", "0.5"))  # con 1.0 le modalità opus e worker copiano gli stream Opus senza ricodifica
+MAX_VOLUME = 2.0  # volume massimo impostabile con !volume
+
+# Worker audio fuori processo (modalità "worker")
+AUDIO_WORKERS = int(os.getenv("AUDIO_WORKERS", "2"))  # processi worker
+AUDIO_WORKER_BUFFER = 250  # pacchetti Opus (20 ms) in anticipo per stream
+AUDIO_WORKER_BATCH = 10  # pacchetti per messaggio dal worker
+AUDIO_WORKER_READ_TIMEOUT = 10  # secondi senza pacchetti prima di chiudere il brano
+
+# Cache audio su disco (vuoto per disattivarla)
+AUDIO_CACHE_DIR = os.getenv("AUDIO_CACHE_DIR", "")
+AUDIO_CACHE_MAX_MB = int(os.getenv("AUDIO_CACHE_MAX_MB", "2048"))
+AUDIO_CACHE_MIN_PLAYS = 3  # riproduzioni prima di salvare il brano
+AUDIO_CACHE_MAX_DURATION = 900  # secondi, i brani più lunghi non vengono salvati
+AUDIO_CACHE_MAX_TRACKED = 10000  # brani di cui si contano le riproduzioni (LRU)
+
+# Scadenza degli stream risolti
+STREAM_EXPIRY_MARGIN = 60  # secondi di margine prima della scadenza
+STREAM_FALLBACK_TTL = 1800  # secondi, se l'URL non riporta la scadenza
+STREAM_REFRESH_INTERVAL = 60  # secondi tra due controlli degli stream in coda
+STREAM_REFRESH_AHEAD = 600  # secondi, riestrae se lo stream scade meno di così dopo l'avvio stimato
+STREAM_REFRESH_LOOKAHEAD = 5  # tracce controllate in testa a ogni coda
+STREAM_REFRESH_BATCH = 5  # stream riestratti al massimo per controllo
+STREAM_RECOVERY_TOLERANCE = 5  # secondi, un brano finito prima della durata è considerato interrotto
+STREAM_MAX_RECOVERIES = 2  # riprese dopo un'interruzione per brano
+
+# Cache delle estrazioni
+CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", "cache.db")  # vuoto per disattivare il disco
+CACHE_MEMORY_SIZE = 512  # voci nella LRU in memoria
+CACHE_MAX_ENTRIES = 10000  # voci massime su disco
+CACHE_METADATA_TTL = 7 * 24 * 3600  # secondi
+
+# Indice locale delle ricerche
+SEARCH_INDEX_THRESHOLD = float(os.getenv("SEARCH_INDEX_THRESHOLD", "0.85"))  # somiglianza minima con una query già risolta per riusarne la traccia, 1 = solo query identiche
+SEARCH_INDEX_MAX_ENTRIES = 20000  # query e titoli indicizzati
+SEARCH_INDEX_MAX_CANDIDATES = 200  # chiavi confrontate per ricerca
+SEARCH_RESULTS = 5  # risultati cercati su YouTube e mostrati dall'indice per !search
+SEARCH_PICK_TIMEOUT = 300  # secondi in cui i risultati di !search restano selezionabili
+
+# Metriche
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # 0 per disattivare l'endpoint
+METRICS_JSON_LOG = os.getenv("METRICS_JSON_LOG", "") == "1"  # log JSON su stdout
+
 # Configurazioni varie
-AUTO_DISCONNECT_TIMEOUT = 30  # secondi
-PROGRESS_UPDATE_INTERVAL = 1.25  # secondi
+AUTO_DISCONNECT_TIMEOUT = 30  # secondi, canale vuoto o coda finita
+AUTO_DISCONNECT_PAUSE_TIMEOUT = 600  # secondi in pausa prima di disconnettersi
+PROGRESS_UPDATE_INTERVAL = 1.25  # secondi, minimo tra due modifiche nello stesso canale
+PROGRESS_GLOBAL_EDIT_RATE = 5  # modifiche al secondo per tutte le guild
+PROGRESS_SCHEDULER_TICK = 0.25  # secondi
 PROGRESS_BAR_LENGTH = 25
+PRESENCE_UPDATE_WINDOW = 15  # secondi minimi tra due aggiornamenti della presenza
+PLAYLIST_BATCH_SIZE = 50  # canzoni aggiunte alla coda per blocco
+PLAYLIST_WORKERS = 2  # scansioni di playlist simultanee, fuori dal pool delle estrazioni
+QUEUE_SPILL_THRESHOLD = int(os.getenv("QUEUE_SPILL_THRESHOLD", "0"))  # tracce in memoria prima di scrivere su disco, 0 = mai
+QUEUE_SPILL_BATCH = 200  # tracce ricaricate dal disco per volta
+QUEUE_STATE_DIR = os.getenv("QUEUE_STATE_DIR", "queues")  # code salvate per guild, vuoto per disattivare
+QUEUE_CHECKPOINT_INTERVAL = 10  # secondi tra due salvataggi della posizione
+QUEUE_COMPACT_MIN_ENTRIES = 500  # righe di log prima di compattare il file di una guild
+
+PLAYER_IDLE_TTL = 900  # secondi prima di rimuovere un player non connesso e inutilizzato
+PLAYER_SWEEP_INTERVAL = 300  # secondi tra due controlli dei player inutilizzati
+PLAYBACK_MAX_FAILURES = 3  # errori consecutivi prima di interrompere la coda
+
+# Prefetch della prossima canzone
+PREFETCH_WARM_FFMPEG = True  # avvia FFmpeg in anticipo per il prossimo brano
+PREFETCH_WARM_LEAD = 10  # secondi prima della fine del brano corrente
@@ -0,0 +1,207 @@
+import asyncio
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from config import (
+    YTDL_FORMAT_OPTIONS,
+    EXTRACTION_MODE,
+    EXTRACTION_WORKERS,
+    EXTRACTION_MAX_PENDING,
+    PLAYLIST_WORKERS,
+)
+from metrics import metrics
+
+# Profili yt-dlp disponibili per le estrazioni
+YTDL_PROFILES = {
+    "default": YTDL_FORMAT_OPTIONS,
+    # Estrazione flat: solo ID e titoli, senza risolvere ogni elemento
+    "flat": {
+        **YTDL_FORMAT_OPTIONS,
+        "noplaylist": False,
+        "extract_flat": "in_playlist",
+    },
+}
+
+# Istanze YoutubeDL per thread: non sono sicure in uso concorrente
+_local = threading.local()
+
+
+def get_ytdl(profile="default"):
+    """Restituisce l'istanza YoutubeDL del worker corrente per il profilo"""
+    instances = getattr(_local, "instances", None)
+    if instances is None:
+        instances = _local.instances = {}
+    if profile not in instances:
+        # Importato alla prima estrazione (o dal warm-up), non all'avvio del bot
+        import yt_dlp
+
+        instances[profile] = yt_dlp.YoutubeDL(YTDL_PROFILES[profile])
+    return instances[profile]
+
+
+def _warm_worker():
+    """Eseguita nel worker: carica yt-dlp e crea l'istanza predefinita"""
+    get_ytdl("default")
+
+
+def _run_extraction(profile, query, sanitize):
+    """Eseguita nel worker: estrae le informazioni con l'istanza locale"""
+    ytdl = get_ytdl(profile)
+    data = ytdl.extract_info(query, download=False)
+    # Tra processi il risultato deve essere serializzabile
+    return ytdl.sanitize_info(data) if sanitize else data
+
+
+class ExtractionService:
+    """Pool dedicato per le estrazioni yt-dlp.
+
+    Ogni worker ha le proprie istanze YoutubeDL, le richieste in attesa sono
+    limitate e quelle identiche in corso vengono unite in un'unica estrazione.
+    """
+
+    def __init__(
+        self,
+        workers=EXTRACTION_WORKERS,
+        mode=EXTRACTION_MODE,
+        max_pending=EXTRACTION_MAX_PENDING,
+        playlist_workers=PLAYLIST_WORKERS,
+    ):
+        self.workers = workers
+        self.mode = mode
+        self.max_pending = max_pending
+        self.playlist_workers = playlist_workers
+        self._executor = None
+        self._thread_executor = None
+        self._playlist_executor = None
+        self.playlist_walks = 0  # scansioni di playlist in corso o in attesa
+        self._pending = {}  # (profilo, query) -> future in corso
+        self._warm = None
+        self.requests = 0
+        self.coalesced = 0
+        self.rejected = 0
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.mode == "process":
+                # spawn: il processo del bot ha già thread attivi (scritture
+                # della cache, worker audio) e un fork potrebbe bloccarsi sui loro lock
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            else:
+                self._executor = self._get_thread_executor()
+        return self._executor
+
+    def _get_thread_executor(self):
+        if self._thread_executor is None:
+            self._thread_executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="ytdl"
+            )
+        return self._thread_executor
+
+    def _get_playlist_executor(self):
+        if self._playlist_executor is None:
+            self._playlist_executor = ThreadPoolExecutor(
+                max_workers=self.playlist_workers, thread_name_prefix="ytdl-playlist"
+            )
+        return self._playlist_executor
+
+    async def extract(self, query, profile="default"):
+        """Estrae le informazioni, unendo le richieste identiche in corso"""
+        self.requests += 1
+        key = (profile, query)
+
+        future = self._pending.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            if len(self._pending) >= self.max_pending:
+                self.rejected += 1
+                raise Exception("Troppe richieste in coda, riprova tra poco")
+
+            metrics.inc("extractions_total", profile=profile)
+            start = time.perf_counter()
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(
+                self._get_executor(),
+                _run_extraction,
+                profile,
+                query,
+                self.mode == "process",
+            )
+            self._pending[key] = future
+            future.add_done_callback(
+                lambda f: self._on_done(key, f, time.perf_counter() - start)
+            )
+
+        # shield: l'annullamento di un chiamante non ferma gli altri
+        return await asyncio.shield(future)
+
+    def _on_done(self, key, future, seconds):
+        self._pending.pop(key, None)
+        metrics.observe("extraction", seconds)
+        if not future.cancelled() and future.exception():
+            metrics.error("extraction", future.exception())
+
+    def warm_up(self):
+        """Carica yt-dlp in background, così la prima richiesta non paga l'import"""
+        if self._warm is None:
+            start = time.perf_counter()
+            self._warm = asyncio.get_running_loop().run_in_executor(
+                self._get_executor(), _warm_worker
+            )
+            self._warm.add_done_callback(
+                lambda f: self._on_warm(f, time.perf_counter() - start)
+            )
+        return self._warm
+
+    def _on_warm(self, future, seconds):
+        if future.cancelled() or future.exception():
+            # Nuovo tentativo al prossimo warm-up; l'estrazione caricherà comunque yt-dlp
+            self._warm = None
+            if not future.cancelled():
+                print(f"Errore nel caricamento di yt-dlp: {future.exception()}")
+            return
+        metrics.observe("ytdl_warm", seconds)
+
+    def run_playlist_walk(self, func):
+        """Esegue la scansione di una playlist in un pool separato.
+
+        Una scansione occupa il suo thread per tutta la playlist: nel pool
+        delle estrazioni bloccherebbe play, prefetch e refresh di tutte le guild.
+        """
+        self.playlist_walks += 1
+        future = asyncio.get_running_loop().run_in_executor(
+            self._get_playlist_executor(), func
+        )
+        future.add_done_callback(self._on_walk_done)
+        return future
+
+    def _on_walk_done(self, future):
+        self.playlist_walks -= 1
+
+    def stats(self):
+        """Statistiche del servizio"""
+        return {
+            "requests": self.requests,
+            "coalesced": self.coalesced,
+            "rejected": self.rejected,
+            "pending": len(self._pending),
+            "playlist_walks": self.playlist_walks,
+        }
+
+    def shutdown(self):
+        for executor in {self._executor, self._thread_executor, self._playlist_executor}:
+            if executor:
+                executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+        self._thread_executor = None
+        self._playlist_executor = None
+        self._warm = None
+
+
+# Servizio condiviso da tutte le guild
+extraction_service = ExtractionService()
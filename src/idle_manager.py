@@ -0,0 +1,75 @@
+import asyncio
+
+from config import AUTO_DISCONNECT_TIMEOUT, AUTO_DISCONNECT_PAUSE_TIMEOUT
+
+
+class IdleManager:
+    """Disconnessione per inattività guidata dagli eventi.
+
+    Ogni cambio di stato (eventi vocali, pausa, fine coda) rivaluta solo la
+    guild interessata e programma o annulla un timer: le guild attive non
+    costano nulla tra un evento e l'altro.
+    """
+
+    def __init__(
+        self,
+        disconnect,
+        timeout=AUTO_DISCONNECT_TIMEOUT,
+        pause_timeout=AUTO_DISCONNECT_PAUSE_TIMEOUT,
+    ):
+        self.disconnect = disconnect  # coroutine che disconnette un player
+        self.timeout = timeout
+        self.pause_timeout = pause_timeout
+
+    def idle_reason(self, player):
+        """Motivo di inattività del player, o None se è attivo"""
+        voice_client = player.voice_client
+        if not voice_client or not voice_client.is_connected():
+            return None
+        if not player.has_listeners():
+            return "canale vuoto"
+        if voice_client.is_paused():
+            return "in pausa"
+        if not voice_client.is_playing() and not player.current_song:
+            return "coda vuota"
+        return None
+
+    def evaluate(self, player):
+        """Programma o annulla il timer di disconnessione del player"""
+        reason = self.idle_reason(player)
+        if reason is None:
+            self.cancel(player)
+            return
+
+        # Timer già programmato per lo stesso motivo: nessun cambiamento
+        if player.disconnect_timer and player.idle_reason == reason:
+            return
+
+        self.cancel(player)
+        delay = self.pause_timeout if reason == "in pausa" else self.timeout
+        player.idle_reason = reason
+        player.disconnect_timer = asyncio.get_running_loop().call_later(
+            delay, lambda: asyncio.create_task(self._expire(player, reason))
+        )
+
+    def cancel(self, player):
+        if player.disconnect_timer:
+            player.disconnect_timer.cancel()
+        player.disconnect_timer = None
+        player.idle_reason = None
+
+    async def _expire(self, player, reason):
+        player.disconnect_timer = None
+        player.idle_reason = None
+
+        # Lo stato potrebbe essere cambiato senza eventi: ricontrolla
+        if self.idle_reason(player) != reason:
+            self.evaluate(player)
+            return
+
+        try:
+            guild = player.voice_client.guild
+            await self.disconnect(player)
+            print(f"Auto-disconnesso da {guild.id} per inattività ({reason})")
+        except Exception as e:
+            print(f"Errore auto-disconnect: {e}")
@@ -1,29 +1,56 @@
-import discord
-from discord.ext import commands
-from config import DISCORD_TOKEN, COMMAND_PREFIX
-from commands import MusicCommands
+import time
 
+# Inizio dell'avvio, prima degli import pesanti
+_started = time.perf_counter()
 
-def main():
-    # Verifica token
-    if not DISCORD_TOKEN:
-        raise ValueError(
-            "Token Discord non trovato. Assicurati di avere un file .env con DISCORD_TOKEN impostato."
-        )
+import asyncio  # noqa: E402
+import multiprocessing  # noqa: E402
+
+import aiohttp  # noqa: E402
+import discord  # noqa: E402
+from discord.ext import commands  # noqa: E402
+from config import (  # noqa: E402
+    DISCORD_TOKEN,
+    COMMAND_PREFIX,
+    SHARD_COUNT,
+    SHARD_PROCESSES,
+    SHARD_STABLE_UPTIME,
+    METRICS_PORT,
+)
+from commands import MusicCommands  # noqa: E402
+from extraction_service import extraction_service  # noqa: E402
+from metrics import metrics, start_metrics_server  # noqa: E402
+from presence import presence_aggregator  # noqa: E402
 
+
+def create_bot(shard_ids=None, shard_count=None, metrics_port=METRICS_PORT):
+    """Crea il bot; con shard_count ("auto" o un numero) usa AutoShardedBot"""
     # Configurazione del bot
     intents = discord.Intents.default()
     intents.message_content = True
     intents.voice_states = True
-    bot = commands.Bot(command_prefix=COMMAND_PREFIX, intents=intents)
+
+    if shard_count is not None:
+        # Con "auto" AutoShardedBot usa il numero di shard consigliato
+        bot = commands.AutoShardedBot(
+            command_prefix=COMMAND_PREFIX,
+            intents=intents,
+            shard_ids=shard_ids,
+            shard_count=None if shard_count == "auto" else shard_count,
+        )
+    else:
+        bot = commands.Bot(command_prefix=COMMAND_PREFIX, intents=intents)
 
     @bot.event
     async def on_ready():
-        print(f"{bot.user} è connesso e pronto!")
-        await bot.change_presence(
-            activity=discord.Game(name="🎵 Pronto per la musica!"),
-            status=discord.Status.idle,
-        )
+        shards = f" (shard {list(bot.shards)})" if bot.shard_count else ""
+        print(f"{bot.user} è connesso e pronto!{shards}")
+        if ("startup_seconds", ()) not in metrics.gauges:
+            metrics.set_gauge("startup_seconds", time.perf_counter() - _started)
+        # yt-dlp si carica ora, dopo il login, invece che all'import
+        extraction_service.warm_up()
+        # Nuova sessione: la presenza va reinviata
+        presence_aggregator.refresh(bot)
 
     # Carica i comandi
     async def load_commands():
@@ -34,10 +61,115 @@ def main():
         """Chiamato quando il bot si avvia per caricare i comandi"""
         await load_commands()
         print("Comandi caricati!")
+        await start_metrics_server(port=metrics_port)
+
+    return bot
+
 
-    # Avvia il bot
+def run_bot(shard_ids=None, shard_count=None, metrics_port=METRICS_PORT):
+    """Avvia un bot (eseguito anche nei processi worker del supervisore)"""
+    bot = create_bot(shard_ids, shard_count, metrics_port)
     bot.run(DISCORD_TOKEN)
 
 
+async def fetch_recommended_shards():
+    """Chiede a Discord il numero di shard consigliato"""
+    headers = {"Authorization": f"Bot {DISCORD_TOKEN}"}
+    async with aiohttp.ClientSession() as session:
+        async with session.get(
+            "https://discord.com/api/v10/gateway/bot", headers=headers
+        ) as response:
+            response.raise_for_status()
+            data = await response.json()
+    return data["shards"]
+
+
+def shard_groups(shard_count, processes):
+    """Distribuisce gli shard tra i processi"""
+    return [
+        list(range(i, shard_count, processes))
+        for i in range(min(processes, shard_count))
+    ]
+
+
+def supervise(shard_count, processes):
+    """Avvia un processo per gruppo di shard e lo riavvia se termina.
+
+    Ogni processo ha i propri MusicPlayer: le guild di uno shard vivono
+    solo nel processo che lo gestisce, e la codifica audio si distribuisce
+    sui core.
+    """
+    context = multiprocessing.get_context("spawn")
+    groups = shard_groups(shard_count, processes)
+    workers = {}
+    started_at = {}  # indice -> avvio dell'ultimo processo
+    restarts = {}  # indice -> riavvii consecutivi
+    pending = {}  # indice -> momento del riavvio programmato
+
+    def start(index):
+        port = METRICS_PORT + index if METRICS_PORT else 0
+        process = context.Process(
+            target=run_bot,
+            args=(groups[index], shard_count, port),
+            name=f"musicbot-shards-{index}",
+        )
+        process.start()
+        workers[index] = process
+        started_at[index] = time.monotonic()
+        print(f"Processo {index} avviato con shard {groups[index]}")
+
+    for index in range(len(groups)):
+        start(index)
+
+    try:
+        while True:
+            time.sleep(5)
+            now = time.monotonic()
+            for index, process in list(workers.items()):
+                if index in pending or process.is_alive():
+                    continue
+                # Un processo rimasto attivo a lungo riparte dal backoff minimo
+                if now - started_at[index] >= SHARD_STABLE_UPTIME:
+                    restarts[index] = 0
+                # Backoff crescente per non riavviare a raffica; il riavvio è
+                # solo programmato, così gli altri gruppi restano sorvegliati
+                restarts[index] = restarts.get(index, 0) + 1
+                delay = min(2 ** restarts[index], 60)
+                pending[index] = now + delay
+                print(
+                    f"Processo {index} terminato (codice {process.exitcode}), "
+                    f"riavvio tra {delay}s"
+                )
+
+            for index, restart_at in list(pending.items()):
+                if restart_at <= now:
+                    del pending[index]
+                    start(index)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in workers.values():
+            process.terminate()
+        for process in workers.values():
+            process.join()
+
+
+def main():
+    # Verifica token
+    if not DISCORD_TOKEN:
+        raise ValueError(
+            "Token Discord non trovato. Assicurati di avere un file .env con DISCORD_TOKEN impostato."
+        )
+
+    if SHARD_PROCESSES > 1:
+        shard_count = SHARD_COUNT
+        if not isinstance(shard_count, int):
+            shard_count = asyncio.run(fetch_recommended_shards())
+        supervise(max(shard_count, SHARD_PROCESSES), SHARD_PROCESSES)
+    else:
+        # Avvia il bot
+        run_bot(shard_count=SHARD_COUNT)
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,229 @@
+import asyncio
+import json
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from config import METRICS_HOST, METRICS_PORT, METRICS_JSON_LOG
+
+# Limiti superiori dei bucket degli istogrammi (secondi)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class Metrics:
+    """Registro delle metriche in formato Prometheus.
+
+    Contatori e istogrammi sono aggiornati nei punti caldi; i gauge e le
+    statistiche degli altri componenti sono letti dai collector a ogni scrape.
+    """
+
+    def __init__(self, json_log=METRICS_JSON_LOG):
+        self.json_log = json_log
+        self.counters = defaultdict(float)  # (nome, etichette) -> valore
+        self.gauges = {}
+        self.histograms = {}
+        self.collectors = []  # funzioni che restituiscono [(tipo, nome, etichette, valore)]
+        self.loop_lag = 0.0
+
+    def inc(self, name, value=1, **labels):
+        self.counters[(name, tuple(sorted(labels.items())))] += value
+
+    def set_gauge(self, name, value, **labels):
+        self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, stage, seconds):
+        """Registra la durata di una fase"""
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = Histogram()
+        histogram.observe(seconds)
+        self.log("stage", stage=stage, seconds=round(seconds, 6))
+
+    @contextmanager
+    def timer(self, stage):
+        """Misura la durata del blocco (anche se contiene await)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def error(self, stage, error):
+        """Conta un errore e lo registra nel log strutturato"""
+        self.inc("errors_total", stage=stage)
+        self.log("error", stage=stage, error=str(error))
+
+    def register_collector(self, collector):
+        self.collectors.append(collector)
+
+    def log(self, event, **fields):
+        if self.json_log:
+            print(json.dumps({"ts": time.time(), "event": event, **fields}))
+
+    async def monitor_loop_lag(self, interval=0.5):
+        """Misura quanto l'event loop ritarda i risvegli"""
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.loop_lag = time.perf_counter() - start - interval
+
+    def render(self):
+        """Esporta tutte le metriche nel formato testuale di Prometheus"""
+        lines = []
+
+        def labels_text(labels):
+            if not labels:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+        types = {}
+        samples = []
+        for (name, labels), value in self.counters.items():
+            types[name] = "counter"
+            samples.append((name, labels, value))
+        for (name, labels), value in self.gauges.items():
+            types[name] = "gauge"
+            samples.append((name, labels, value))
+        samples.append(("event_loop_lag_seconds", (), self.loop_lag))
+        types["event_loop_lag_seconds"] = "gauge"
+
+        for collector in self.collectors:
+            try:
+                for kind, name, labels, value in collector():
+                    types[name] = kind
+                    samples.append((name, tuple(sorted(labels.items())), value))
+            except Exception as e:
+                print(f"Errore nel collector delle metriche: {e}")
+
+        for name in sorted(types):
+            lines.append(f"# TYPE musicbot_{name} {types[name]}")
+            for sample_name, labels, value in samples:
+                if sample_name == name:
+                    lines.append(f"musicbot_{name}{labels_text(labels)} {value}")
+
+        name = "musicbot_stage_seconds"
+        if self.histograms:
+            lines.append(f"# TYPE {name} histogram")
+        for stage, histogram in sorted(self.histograms.items()):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {histogram.sum}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {histogram.count}')
+
+        return "\n".join(lines) + "\n"
+
+
+def collect_bot_state():
+    """Collector predefinito: player, code e statistiche dei componenti condivisi"""
+    from audio_workers import audio_workers
+    from player_registry import player_registry
+    from ytdl_source import track_cache, search_index
+    from extraction_service import extraction_service
+    from progress_scheduler import progress_scheduler
+    from presence import presence_aggregator
+    from queue_journal import queue_journal
+    from stream_refresher import stream_refresher
+
+    registry = player_registry.stats()
+    samples = [
+        ("gauge", "players", {}, registry["live"]),
+        ("gauge", "active_players", {}, registry["connected"]),
+        (
+            "gauge",
+            "queue_length",
+            {},
+            sum(len(p.queue) for p in player_registry.players.values()),
+        ),
+        ("counter", "players_created_total", {}, registry["created"]),
+        ("counter", "players_released_total", {}, registry["released"]),
+        ("counter", "players_evicted_total", {}, registry["evicted"]),
+    ]
+
+    cache = track_cache.stats()
+    for layer, hits, misses in (
+        ("metadata", cache["hits"], cache["misses"]),
+        ("stream", cache["stream_hits"], cache["stream_misses"]),
+    ):
+        samples.append(("counter", "cache_hits_total", {"layer": layer}, hits))
+        samples.append(("counter", "cache_misses_total", {"layer": layer}, misses))
+    samples.append(("counter", "cache_disk_errors_total", {}, cache["disk_errors"]))
+
+    index = search_index.stats()
+    samples.append(("gauge", "search_index_entries", {}, index["entries"]))
+    samples.append(("counter", "search_index_hits_total", {}, index["hits"]))
+    samples.append(("counter", "search_index_misses_total", {}, index["misses"]))
+
+    extraction = extraction_service.stats()
+    samples.append(("counter", "extraction_requests_total", {}, extraction["requests"]))
+    samples.append(("counter", "extraction_coalesced_total", {}, extraction["coalesced"]))
+    samples.append(("counter", "extraction_rejected_total", {}, extraction["rejected"]))
+    samples.append(("gauge", "extraction_pending", {}, extraction["pending"]))
+    samples.append(("gauge", "playlist_walks", {}, extraction["playlist_walks"]))
+
+    progress = progress_scheduler.stats()
+    samples.append(("gauge", "progress_players", {}, progress["players"]))
+    samples.append(("counter", "progress_edits_skipped_total", {}, progress["skipped"]))
+
+    workers = audio_workers.stats()
+    samples.append(("gauge", "audio_workers", {}, workers["workers"]))
+    samples.append(("gauge", "audio_worker_streams", {}, workers["streams"]))
+
+    presence = presence_aggregator.stats()
+    samples.append(("gauge", "presence_guilds", {}, presence["guilds"]))
+    samples.append(("counter", "presence_collapsed_total", {}, presence["collapsed"]))
+    samples.append(("counter", "presence_skipped_total", {}, presence["skipped"]))
+
+    refresher = stream_refresher.stats()
+    samples.append(("gauge", "stream_refresh_players", {}, refresher["players"]))
+    samples.append(("counter", "stream_refresh_failures_total", {}, refresher["failed"]))
+    samples.append(("counter", "stream_refresh_deferred_total", {}, refresher["deferred"]))
+
+    journal = queue_journal.stats()
+    samples.append(("counter", "queue_journal_writes_total", {}, journal["writes"]))
+    samples.append(("counter", "queue_restores_total", {}, journal["restored"]))
+    return samples
+
+
+# Registro condiviso
+metrics = Metrics()
+metrics.register_collector(collect_bot_state)
+
+
+async def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Avvia l'endpoint HTTP /metrics locale e il monitor dell'event loop"""
+    asyncio.create_task(metrics.monitor_loop_lag())
+    if not port:
+        return None
+
+    # Importato solo con l'endpoint attivo: aiohttp pesa sull'avvio
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(text=metrics.render(), content_type="text/plain")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"Metriche disponibili su http://{host}:{port}/metrics")
+    return runner
@@ -1,215 +1,337 @@
 import asyncio
-import time
-import discord
 from typing import List
-from collections import deque
-from config import PROGRESS_BAR_LENGTH
-
-from utils import get_bell_interval
+from config import (
+    PREFETCH_WARM_FFMPEG,
+    PREFETCH_WARM_LEAD,
+    DEFAULT_AUDIO_MODE,
+    DEFAULT_VOLUME,
+)
+
+from audio_cache import audio_cache
+from metrics import metrics
+from presence import presence_aggregator
+from progress_renderer import ProgressRenderer, UNCHANGED
+from progress_scheduler import progress_scheduler
+from queue_journal import queue_journal
+from stream_refresher import stream_refresher
+from track import TrackQueue
+from ytdl_source import YTDLSource, resolve_stream, is_stream_valid
 
 
 class MusicPlayer:
-    def __init__(self):
-        self.queue = deque()
+    def __init__(self, guild_id=None):
+        self.guild_id = guild_id
+        self.queue = TrackQueue()
         self.voice_client = None
+        self.controller = None  # PlaybackController della guild
         self.current_song = None
-        self.start_time = None
+        self.source = None  # Sorgente in riproduzione, fornisce la posizione
         self.current_duration = 0
-        self.disconnect_timer = None
+        self.disconnect_timer = None  # Timer di disconnessione per inattività
+        self.idle_reason = None
         self.progress_message = None  # Messaggio del progresso live
-        self.progress_task = None  # Task per aggiornamento progresso
+        self.progress_renderer = None  # Rendering del progresso della traccia corrente
+        self.prefetch_song = None  # Canzone in testa alla coda in prefetch
+        self.prefetch_task = None  # Task di risoluzione anticipata
+        self.prefetch_warm_handle = None  # Avvio programmato di FFmpeg
+        self.prefetched_source = None  # Sorgente già pronta per il prossimo brano
+        self.audio_mode = DEFAULT_AUDIO_MODE  # "opus" o "pcm"
+        self.volume = DEFAULT_VOLUME
 
     def add_to_queue(self, songs: List):
         """Aggiunge una canzone alla coda"""
+        songs = list(songs)
         self.queue.extend(songs)
+        queue_journal.add(self.guild_id, songs)
+        self.schedule_prefetch()
 
     def get_next_song(self):
         """Ottiene la prossima canzone dalla coda"""
-        return self.queue.popleft() if self.queue else None
+        if not self.queue:
+            return None
+        queue_journal.pop(self.guild_id)
+        return self.queue.popleft()
 
     def clear_queue(self):
         """Svuota la coda"""
         self.queue.clear()
+        queue_journal.clear(self.guild_id)
+        self.invalidate_prefetch()
+
+    def insert_next(self, songs: List):
+        """Inserisce le canzoni in testa alla coda"""
+        songs = list(songs)
+        self.queue.insert(0, songs)
+        queue_journal.insert(self.guild_id, 0, songs)
+        self.schedule_prefetch()
+
+    def move_in_queue(self, source, target):
+        """Sposta una canzone nella coda e la restituisce"""
+        song = self.queue.move(source, target)
+        queue_journal.move(self.guild_id, source, target)
+        self.schedule_prefetch()
+        return song
+
+    def remove_from_queue(self, start, stop):
+        """Rimuove le canzoni da `start` a `stop` escluso e le restituisce"""
+        removed = self.queue.remove_range(start, stop)
+        if removed:
+            start = max(start, 0)
+            queue_journal.remove(self.guild_id, start, start + len(removed))
+            self.schedule_prefetch()
+        return removed
+
+    def shuffle_queue(self):
+        """Mescola la coda"""
+        order = self.queue.shuffle()
+        queue_journal.reorder(self.guild_id, order)
+        self.schedule_prefetch()
+
+    def dedupe_queue(self):
+        """Rimuove le canzoni ripetute dalla coda; restituisce quante"""
+        size = len(self.queue)
+        order = self.queue.dedupe()
+        removed = size - len(order)
+        if removed:
+            queue_journal.reorder(self.guild_id, order)
+            self.schedule_prefetch()
+        return removed
+
+    def set_audio_mode(self, mode):
+        """Imposta la modalità audio della guild dal prossimo brano"""
+        self.audio_mode = mode
+        # La sorgente già avviata usa la modalità precedente
+        self.invalidate_prefetch()
+        self.schedule_prefetch()
+
+    def set_volume(self, volume):
+        """Imposta il volume della guild; True se applicato già al brano corrente"""
+        self.volume = volume
+        # Con le sorgenti Opus il volume è un filtro di FFmpeg: vale dal prossimo brano
+        self.invalidate_prefetch()
+        self.schedule_prefetch()
+        if getattr(self.source, "live_volume", False):
+            self.source.volume = volume
+            return True
+        return False
+
+    def create_source(self, song, offset=0):
+        """Crea la sorgente audio per una traccia risolta con le impostazioni della guild"""
+        return YTDLSource.from_resolved(
+            song, audio_mode=self.audio_mode, volume=self.volume, offset=offset
+        )
 
-    def get_queue_list(self, limit=5):
-        """Restituisce una lista delle canzoni in coda"""
-        return list(self.queue)[:limit]
+    def schedule_prefetch(self):
+        """Risolve in anticipo la canzone in testa alla coda"""
+        head = self.queue[0] if self.queue else None
+        if head is not None and head is self.prefetch_song:
+            return
 
-    async def update_bot_status(self, bot, song_title=None, is_paused=False):
-        """Aggiorna lo status del bot"""
+        self.invalidate_prefetch()
+        if head is None or not self.current_song:
+            return
+
+        self.prefetch_song = head
+        self.prefetch_task = asyncio.create_task(self._prefetch(head))
+
+    async def _prefetch(self, song):
+        """Risolve lo stream e programma l'avvio anticipato di FFmpeg"""
         try:
-            if song_title:
-                clean_title = song_title[:120]
-
-                if is_paused:
-                    activity = discord.Activity(
-                        type=discord.ActivityType.listening, name=f"⏸️ {clean_title}"
-                    )
-                else:
-                    activity = discord.Activity(
-                        type=discord.ActivityType.listening, name=f"🎵 {clean_title}"
-                    )
-
-                await bot.change_presence(
-                    activity=activity, status=discord.Status.online
-                )
-            else:
-                await bot.change_presence(
-                    activity=discord.Game(name="🎵 Pronto per la musica!"),
-                    status=discord.Status.idle,
-                )
+            await resolve_stream(song)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            metrics.error("prefetch", e)
+            print(f"Errore nel prefetch: {e}")
+            return
+
+        if PREFETCH_WARM_FFMPEG:
+            elapsed = self.get_position()
+            delay = max(self.current_duration - elapsed - PREFETCH_WARM_LEAD, 0)
+            self.prefetch_warm_handle = asyncio.get_running_loop().call_later(
+                delay, self._warm_source, song
+            )
+
+    def _warm_source(self, song):
+        """Avvia FFmpeg per il prossimo brano poco prima della fine di quello corrente"""
+        self.prefetch_warm_handle = None
+        if song is not self.prefetch_song:
+            return
+        if not is_stream_valid(song) and not audio_cache.contains(song.get("id")):
+            return
 
+        try:
+            self.prefetched_source = self.create_source(song)
         except Exception as e:
-            print(f"Errore aggiornamento status: {e}")
+            print(f"Errore nell'avvio anticipato di FFmpeg: {e}")
+
+    async def take_prefetched(self, song):
+        """Restituisce la sorgente pre-avviata per la canzone, se disponibile"""
+        if song is not self.prefetch_song:
+            self.invalidate_prefetch()
+            return None
+
+        # Risoluzione già in corso: la attende invece di ripeterla. asyncio.wait
+        # non propaga l'annullamento del task (es. !clear durante l'attesa):
+        # in quel caso il chiamante ricrea la sorgente da zero
+        task = self.prefetch_task
+        if task and not task.done():
+            await asyncio.wait({task})
+        if song is not self.prefetch_song:
+            return None
+
+        source = self.prefetched_source
+        self.prefetched_source = None
+        self.invalidate_prefetch()
+        return source
+
+    def invalidate_prefetch(self):
+        """Annulla il prefetch corrente e chiude l'eventuale FFmpeg già avviato"""
+        if self.prefetch_task:
+            self.prefetch_task.cancel()
+            self.prefetch_task = None
+        if self.prefetch_warm_handle:
+            self.prefetch_warm_handle.cancel()
+            self.prefetch_warm_handle = None
+        if self.prefetched_source:
+            self.prefetched_source.cleanup()
+            self.prefetched_source = None
+        self.prefetch_song = None
+
+    def get_queue_list(self, limit=5):
+        """Restituisce una lista delle canzoni in coda"""
+        return self.queue.page(0, limit)
+
+    async def update_bot_status(self, bot, song_title=None, is_paused=False):
+        """Aggiorna lo status del bot (applicato in blocco per tutte le guild)"""
+        presence_aggregator.report(bot, self.guild_id, song_title, is_paused)
 
-    def start_song(self, song_info):
-        """Avvia il timer per la canzone corrente"""
+    def start_song(self, song_info, source):
+        """Registra la canzone corrente e la sorgente che ne misura la posizione"""
         self.current_song = song_info
-        self.start_time = time.time()
+        self.source = source
         self.current_duration = song_info.get("duration", 0)
+        self.progress_renderer = ProgressRenderer(song_info, self.current_duration)
+        queue_journal.current(self, getattr(source, "offset", 0))
+        audio_cache.record_play(song_info)
+        stream_refresher.watch(self)
+        self.schedule_prefetch()
+
+    def end_song(self):
+        """Nessuna canzone in riproduzione"""
+        self.current_song = None
+        self.source = None
+        self.progress_renderer = None
+        queue_journal.current(self)
+        stream_refresher.forget(self.guild_id)
+
+    def get_position(self):
+        """Secondi della canzone corrente effettivamente inviati a Discord"""
+        if not self.source:
+            return 0
+        return getattr(self.source, "position", 0)
 
     def get_progress(self):
         """Restituisce il progresso della canzone corrente"""
-        if not self.start_time or self.current_duration <= 0:
+        if not self.source or self.current_duration <= 0:
             return 0, 0, "00:00 / 00:00"
 
-        elapsed = time.time() - self.start_time
+        elapsed = self.get_position()
         progress_percent = min((elapsed / self.current_duration) * 100, 100)
-
-        # Handle more than 1 hour long videos
-
-        if self.current_duration >= 3600:
-            time_str = time.strftime("%H:%M:%S", time.gmtime(self.current_duration))
-        else:
-            time_str = time.strftime("%M:%S", time.gmtime(self.current_duration))
-
-        # Formatta il tempo trascorso e il totale
-        if self.current_duration >= 3600:
-            elapsed_str = time.strftime("%H:%M:%S", time.gmtime(elapsed))
-        else:
-            elapsed_str = time.strftime("%M:%S", time.gmtime(elapsed))
-
-        time_str = f"{elapsed_str} / {time_str}"
-
-        return elapsed, progress_percent, time_str
-
-    def create_progress_bar(self, length):
-        """Crea una barra di progresso visuale"""
-
-        if not self.start_time or self.current_duration <= 0:
-            return "━" * length + " 00:00 / 00:00"
-
-        elapsed, progress_percent, time_str = self.get_progress()
-
-        filled = int((progress_percent / 100) * length)
-
-        bar = "━" * filled + "◉" + "━" * (length - filled - 1)
-        if filled >= length:
-            bar = "━" * (length - 1) + "◉"
-
-        return f"{bar} {time_str}"
+        return elapsed, progress_percent, self.progress_renderer.time_text(elapsed)
 
     async def start_progress_updates(self, ctx):
         """Avvia gli aggiornamenti automatici del progresso"""
-        # Cancella task precedente se esiste
-        if self.progress_task:
-            self.progress_task.cancel()
+        progress_scheduler.unregister(self)
 
         # Invia messaggio iniziale
         if self.current_song and self.current_duration > 0:
-            embed = self._create_progress_embed()
-            self.progress_message = await ctx.send(embed=embed)
-
-            # Avvia task di aggiornamento
-            self.progress_task = asyncio.create_task(self._update_progress_loop())
-
-    def _create_progress_embed(self):
-        """Crea l'embed per il progresso"""
-        embed = discord.Embed(
-            title="🎵 Now Playing",
-            description=f"**{self.current_song['title']}**",
-            color=0x1DB954,
+            renderer = self.progress_renderer
+            render = (self._progress_status(), renderer.bar(self.get_position()))
+            self.progress_message = await ctx.send(embed=renderer.embed(render))
+            renderer.sent = render
+
+            # Gli aggiornamenti successivi sono gestiti dallo scheduler condiviso
+            progress_scheduler.register(self)
+
+    async def resume_progress_updates(self, ctx):
+        """Riprende gli aggiornamenti se lo scheduler li ha fermati (es. durante una riestrazione)"""
+        if self.progress_message:
+            if self not in progress_scheduler.players:
+                progress_scheduler.register(self)
+        elif ctx:
+            await self.start_progress_updates(ctx)
+
+    def _progress_status(self):
+        """Stato mostrato sopra la barra di progresso"""
+        if not self.voice_client:
+            return "🔇 Disconnected"
+        if self.voice_client.is_paused():
+            return "⏸️ Paused"
+        return "▶️ Playing"
+
+    def render_progress(self):
+        """Progresso renderizzato, o UNCHANGED se uguale all'ultimo inviato"""
+        if not self.progress_renderer:
+            return UNCHANGED
+        return self.progress_renderer.render(
+            self._progress_status(), self.get_position()
         )
 
-        if self.current_song.get("thumbnail"):
-            embed.set_thumbnail(url=self.current_song["thumbnail"])
-
-        if self.voice_client:
-            if self.voice_client.is_paused():
-                name = "⏸️ Paused"
-            elif self.voice_client.is_playing():
-                name = "▶️ Playing"
-        else:
-            name = "🔇 Disconnected"
-
-        embed.add_field(
-            name=name,
-            value=f"```{self.create_progress_bar(PROGRESS_BAR_LENGTH)}```",
-            inline=False,
-        )
-
-        return embed
-
-    async def _update_progress_loop(self):
-        """Loop per aggiornare il messaggio di progresso"""
-        try:
-            while (
-                self.progress_message
-                and self.current_song
-                and self.voice_client
-                and self.voice_client.is_connected()
-                and (self.voice_client.is_playing() or self.voice_client.is_paused())
-            ):
-                # Calcola tempo trascorso
-                if self.start_time:
-                    elapsed = time.time() - self.start_time
-                else:
-                    elapsed = 0
-
-                # Controlla se la canzone è finita
-                if self.start_time and self.current_duration > 0:
-                    if elapsed >= self.current_duration:
-                        break
-
-                # Aggiorna embed
-                embed = self._create_progress_embed()
-
-                # Aggiorna messaggio
-                try:
-                    await self.progress_message.edit(embed=embed)
-                except discord.NotFound:
-                    # Messaggio cancellato, interrompi loop
-                    break
-                except Exception as e:
-                    print(f"Errore aggiornamento progresso: {e}")
-                    break
-
-                # Calcola l'intervallo dinamico
-                sleep_time = get_bell_interval(elapsed, self.current_duration)
-                await asyncio.sleep(sleep_time)
-
-        except asyncio.CancelledError:
-            pass
-        except Exception as e:
-            print(f"Errore nel loop progresso: {e}")
-        finally:
-            self.progress_message = None
-            self.progress_task = None
+    def create_progress_embed(self, render):
+        """Embed del progresso per un rendering di render_progress"""
+        return self.progress_renderer.embed(render)
+
+    def progress_active(self):
+        """Controlla se il messaggio di progresso va ancora aggiornato"""
+        if not (
+            self.progress_message
+            and self.current_song
+            and self.voice_client
+            and self.voice_client.is_connected()
+            and (self.voice_client.is_playing() or self.voice_client.is_paused())
+        ):
+            return False
+
+        # Controlla se la canzone è finita
+        if self.source and self.current_duration > 0:
+            return self.get_position() < self.current_duration
+        return True
+
+    def has_listeners(self):
+        """Controlla se ci sono utenti (non bot) nel canale vocale"""
+        if not self.voice_client or not self.voice_client.channel:
+            return False
+        return any(not m.bot for m in self.voice_client.channel.members)
 
     def stop_progress_updates(self):
         """Ferma gli aggiornamenti del progresso"""
-        if self.progress_task:
-            self.progress_task.cancel()
-            self.progress_task = None
+        progress_scheduler.unregister(self)
         self.progress_message = None
 
     def cleanup(self):
         """Pulisce tutte le risorse del player"""
         self.queue.clear()
         self.current_song = None
-        self.start_time = None
+        self.source = None
         self.current_duration = 0
+        if self.disconnect_timer:
+            self.disconnect_timer.cancel()
         self.disconnect_timer = None
+        self.idle_reason = None
         self.stop_progress_updates()
+        self.invalidate_prefetch()
         if self.voice_client:
             self.voice_client = None
+
+    def close(self):
+        """Distrugge il player: risorse, controller e riferimenti ai messaggi"""
+        self.cleanup()
+        self.progress_renderer = None
+        if self.controller:
+            self.controller.close()
+            self.controller = None
+        # Lo stato salvato resta su disco per il prossimo ingresso in voce
+        queue_journal.close(self.guild_id)
+        presence_aggregator.forget(self.guild_id)
+        stream_refresher.forget(self.guild_id)
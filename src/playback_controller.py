@@ -0,0 +1,321 @@
+import asyncio
+
+from config import (
+    PLAYBACK_MAX_FAILURES,
+    STREAM_RECOVERY_TOLERANCE,
+    STREAM_MAX_RECOVERIES,
+)
+from metrics import metrics
+from queue_journal import queue_journal
+from ytdl_source import YTDLSource, resolve_stream
+
+
+class PlaybackController:
+    """Macchina a stati della riproduzione di una guild.
+
+    Tutte le transizioni (play, skip, stop, fine brano) passano da un'unica
+    coda di eventi consumata da un task: ogni transizione produce al massimo
+    un'estrazione e un processo FFmpeg, e le fine brano generate da sorgenti
+    già sostituite vengono ignorate.
+    """
+
+    def __init__(self, bot, player, on_state_change=None):
+        self.bot = bot
+        self.player = player
+        self.on_state_change = on_state_change  # chiamata dopo ogni transizione
+        self.events = asyncio.Queue()
+        self.generation = 0  # incrementato a ogni sorgente avviata o fermata
+        self.ctx = None  # contesto dell'ultimo comando, per i messaggi
+        self.recoveries = 0  # riprese del brano corrente dopo un'interruzione
+        self.closed = False
+        self._task = None
+
+    async def play(self, ctx, songs, offset=0, front=False):
+        """Avvia la prima canzone riproducibile se inattivo, altrimenti accoda.
+
+        `offset` è la posizione di partenza della prima canzone (ripristino),
+        con `front` le canzoni vanno in testa alla coda invece che in fondo.
+        Restituisce la canzone avviata o None se sono state tutte accodate.
+        """
+        return await self._call("play", ctx, songs=songs, offset=offset, front=front)
+
+    async def skip(self, ctx):
+        """Salta la canzone corrente; restituisce False se non c'era nulla"""
+        return await self._call("skip", ctx)
+
+    async def seek(self, ctx, position):
+        """Riprende la canzone corrente da `position` secondi.
+
+        Restituisce la posizione effettiva o None se non c'è nulla in riproduzione.
+        """
+        return await self._call("seek", ctx, position=position)
+
+    async def stop(self, ctx=None):
+        """Ferma la riproduzione e svuota la coda"""
+        return await self._call("stop", ctx)
+
+    def on_track_end(self, generation, error):
+        """Callback `after` di discord.py, chiamata dal thread audio"""
+        data = {"generation": generation, "error": error}
+        self.bot.loop.call_soon_threadsafe(self._submit, "track_end", None, data, None)
+
+    async def _call(self, kind, ctx, **data):
+        future = asyncio.get_running_loop().create_future()
+        self._submit(kind, ctx, data, future)
+        return await future
+
+    def _submit(self, kind, ctx, data, future):
+        if self.closed:
+            # Player già distrutto (es. fine brano arrivata dopo la disconnessione)
+            if future and not future.done():
+                future.cancel()
+            return
+        self.events.put_nowait((kind, ctx, data, future))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def close(self):
+        """Annulla il task e gli eventi in attesa; il controller non è più utilizzabile"""
+        self.closed = True
+        self.ctx = None
+        while not self.events.empty():
+            _, _, _, future = self.events.get_nowait()
+            if future and not future.done():
+                future.cancel()
+        if self._task and self._task is not asyncio.current_task():
+            self._task.cancel()
+        self._task = None
+
+    async def _run(self):
+        """Consuma gli eventi uno alla volta"""
+        while not self.events.empty():
+            kind, ctx, data, future = await self.events.get()
+            if ctx is not None:
+                self.ctx = ctx
+
+            try:
+                result = await getattr(self, f"_on_{kind}")(**data)
+            except Exception as e:
+                if future and not future.done():
+                    future.set_exception(e)
+                else:
+                    print(f"Errore nella transizione {kind}: {e}")
+            else:
+                if future and not future.done():
+                    future.set_result(result)
+
+            if self.on_state_change:
+                self.on_state_change(self.player)
+
+    def _is_active(self):
+        voice_client = self.player.voice_client
+        return bool(
+            voice_client and (voice_client.is_playing() or voice_client.is_paused())
+        )
+
+    async def _on_play(self, songs, offset=0, front=False):
+        if self._is_active():
+            if front:
+                self.player.insert_next(songs)
+            else:
+                self.player.add_to_queue(songs)
+            return None
+
+        songs = list(songs)
+        last_error = None
+        failures = 0
+        while songs and failures < PLAYBACK_MAX_FAILURES:
+            song = songs.pop(0)
+            try:
+                await self._start(song, offset)
+            except Exception as e:
+                metrics.error("playback", e)
+                last_error = e
+                failures += 1
+                continue
+            finally:
+                offset = 0
+
+            self.player.add_to_queue(songs)
+            return song
+
+        # Nessuna canzone avviata: le restanti restano in coda
+        self.player.add_to_queue(songs)
+        if last_error:
+            raise last_error
+        return None
+
+    async def _on_skip(self):
+        if not self._is_active():
+            return False
+
+        self.generation += 1
+        self.player.voice_client.stop()
+        self.player.stop_progress_updates()
+        await self._advance()
+        return True
+
+    async def _on_seek(self, position):
+        if not self._is_active() or not self.player.current_song:
+            return None
+
+        duration = self.player.current_duration
+        position = max(position, 0)
+        if duration:
+            position = min(position, max(duration - 1, 0))
+        await self.restart(position)
+        return position
+
+    async def restart(self, offset):
+        """Riavvia la canzone corrente da `offset` secondi.
+
+        Riusa lo stream già risolto (FFmpeg con -ss sull'input) e mantiene lo
+        stato di pausa; da chiamare solo all'interno di una transizione.
+        """
+        player = self.player
+        song = player.current_song
+        paused = player.voice_client.is_paused()
+
+        # Nessuna estrazione finché lo stream è valido
+        await resolve_stream(song)
+        with metrics.timer("seek"):
+            source = player.create_source(song, offset=offset)
+
+        player.voice_client.stop()
+        self._play(source)
+        player.source = source
+        if paused:
+            player.voice_client.pause()
+        queue_journal.position(player)
+
+        # Il prefetch del prossimo brano va riprogrammato sulla nuova posizione
+        player.invalidate_prefetch()
+        player.schedule_prefetch()
+
+    async def _on_stop(self):
+        self.generation += 1
+        self.player.clear_queue()
+        self.player.end_song()
+        self.player.stop_progress_updates()
+        if self.player.voice_client:
+            self.player.voice_client.stop()
+        await self.player.update_bot_status(self.bot)
+
+    async def _on_track_end(self, generation, error):
+        # Fine brano di una sorgente già sostituita (skip/stop): nessuna transizione
+        if generation != self.generation:
+            return
+
+        if error:
+            metrics.error("stream", error)
+            print(f"Errore: {error}")
+        if await self._recover():
+            return
+        await self._advance()
+
+    async def _recover(self):
+        """Riprende un brano interrotto prima della fine (es. stream scaduto, 403).
+
+        FFmpeg termina senza errori quando lo stream viene rifiutato: un brano
+        finito molto prima della sua durata viene riestratto e riavviato dalla
+        posizione raggiunta.
+        """
+        player = self.player
+        duration = player.current_duration
+        if (
+            not player.current_song
+            or not duration
+            or self.recoveries >= STREAM_MAX_RECOVERIES
+            or not player.voice_client
+            or not player.voice_client.is_connected()
+        ):
+            return False
+
+        position = player.get_position()
+        if position >= duration - STREAM_RECOVERY_TOLERANCE:
+            return False
+
+        self.recoveries += 1
+        try:
+            await resolve_stream(player.current_song, force=True)
+            await self.restart(position)
+        except Exception as e:
+            metrics.error("stream_recovery", e)
+            return False
+        metrics.inc("stream_recoveries_total")
+
+        # Durante la riestrazione il brano risultava finito e lo scheduler
+        # può aver smesso di aggiornare il messaggio di progresso
+        try:
+            await player.resume_progress_updates(self.ctx)
+        except Exception as e:
+            print(f"Errore nella ripresa del progresso: {e}")
+        return True
+
+    async def _advance(self):
+        """Passa alla prossima canzone, con un limite di errori consecutivi"""
+        player = self.player
+
+        if not player.voice_client or not player.voice_client.is_connected():
+            await player.update_bot_status(self.bot)
+            return
+
+        failures = 0
+        while failures < PLAYBACK_MAX_FAILURES:
+            next_song = player.get_next_song()
+            if not next_song:
+                break
+
+            try:
+                await self._start(next_song)
+                return
+            except Exception as e:
+                metrics.error("playback", e)
+                failures += 1
+                if self.ctx:
+                    await self.ctx.send(f"Errore: {str(e)}")
+
+        if failures >= PLAYBACK_MAX_FAILURES and self.ctx:
+            await self.ctx.send("⚠️ Troppi errori consecutivi, riproduzione interrotta.")
+
+        player.end_song()
+        player.stop_progress_updates()
+        await player.update_bot_status(self.bot)
+
+    async def _start(self, song, offset=0):
+        """Avvia una canzone: un'estrazione (se necessaria) e un FFmpeg"""
+        player = self.player
+        self.recoveries = 0
+
+        # Usa la sorgente preparata durante il brano precedente, se presente
+        source = None if offset else await player.take_prefetched(song)
+        if not source:
+            source = await YTDLSource.from_url(
+                song["url"],
+                loop=self.bot.loop,
+                song_info=song,
+                audio_mode=player.audio_mode,
+                volume=player.volume,
+                offset=offset,
+            )
+
+        self._play(source)
+        player.start_song(song, source)
+        await player.update_bot_status(self.bot, song["title"])
+
+        if self.ctx:
+            await self._start_progress_updates()
+
+    def _play(self, source):
+        """Avvia la sorgente; la sua fine sarà riconosciuta dalla generazione"""
+        self.generation += 1
+        generation = self.generation
+        self.player.voice_client.play(
+            source, after=lambda e: self.on_track_end(generation, e)
+        )
+
+    async def _start_progress_updates(self):
+        try:
+            await self.player.start_progress_updates(self.ctx)
+        except Exception as e:
+            print(f"Errore nell'avvio automatico del progresso: {e}")
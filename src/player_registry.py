@@ -0,0 +1,109 @@
+import asyncio
+import time
+
+from config import PLAYER_IDLE_TTL, PLAYER_SWEEP_INTERVAL
+
+from music_player import MusicPlayer
+
+
+class PlayerRegistry:
+    """Registro dei music player con ciclo di vita esplicito.
+
+    I player sono creati alla prima richiesta di una guild e distrutti alla
+    disconnessione; quelli non connessi e inutilizzati da `ttl` secondi
+    vengono rimossi da un controllo periodico, così la memoria resta
+    proporzionale alle guild attive.
+    """
+
+    def __init__(self, ttl=PLAYER_IDLE_TTL, sweep_interval=PLAYER_SWEEP_INTERVAL):
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.players = {}  # guild_id -> MusicPlayer
+        self.last_used = {}  # guild_id -> ultimo accesso (monotonic)
+        self.created = 0
+        self.released = 0
+        self.evicted = 0
+        self._sweeper = None
+
+    def get(self, guild_id):
+        """Ottiene o crea il player della guild"""
+        player = self.players.get(guild_id)
+        if player is None:
+            player = self.players[guild_id] = MusicPlayer(guild_id)
+            self.created += 1
+        self.last_used[guild_id] = time.monotonic()
+        self._schedule_sweep()
+        return player
+
+    def peek(self, guild_id):
+        """Restituisce il player della guild senza crearlo"""
+        return self.players.get(guild_id)
+
+    def release(self, guild_id):
+        """Rimuove il player della guild liberandone tutte le risorse"""
+        player = self.players.pop(guild_id, None)
+        self.last_used.pop(guild_id, None)
+        if player is not None:
+            player.close()
+            self.released += 1
+        return player
+
+    def is_cold(self, guild_id, now):
+        player = self.players[guild_id]
+        voice_client = player.voice_client
+        if voice_client and voice_client.is_connected():
+            return False
+        return now - self.last_used.get(guild_id, now) >= self.ttl
+
+    def sweep(self):
+        """Rimuove i player freddi; restituisce quanti ne sono stati rimossi"""
+        now = time.monotonic()
+        cold = [guild_id for guild_id in self.players if self.is_cold(guild_id, now)]
+        for guild_id in cold:
+            self.release(guild_id)
+        self.evicted += len(cold)
+        return len(cold)
+
+    def _schedule_sweep(self):
+        # Un solo timer, programmato solo finché ci sono player
+        if self._sweeper is not None or not self.players:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._sweeper = loop.call_later(self.sweep_interval, self._run_sweep)
+
+    def _run_sweep(self):
+        self._sweeper = None
+        try:
+            evicted = self.sweep()
+            if evicted:
+                print(f"Rimossi {evicted} player inutilizzati")
+        except Exception as e:
+            print(f"Errore nella pulizia dei player: {e}")
+        self._schedule_sweep()
+
+    def stats(self):
+        """Statistiche del registro"""
+        return {
+            "live": len(self.players),
+            "connected": sum(
+                1
+                for p in self.players.values()
+                if p.voice_client and p.voice_client.is_connected()
+            ),
+            "created": self.created,
+            "released": self.released,
+            "evicted": self.evicted,
+        }
+
+
+# Registro condiviso da tutte le guild
+player_registry = PlayerRegistry()
+music_players = player_registry.players
+
+
+def get_music_player(guild_id):
+    """Ottiene o crea un music player per una guild"""
+    return player_registry.get(guild_id)
@@ -0,0 +1,110 @@
+import asyncio
+import time
+
+import discord
+from config import PRESENCE_UPDATE_WINDOW
+
+from metrics import metrics
+
+IDLE_NAME = "🎵 Pronto per la musica!"
+
+
+class PresenceAggregator:
+    """Stato del bot unico per tutte le guild.
+
+    La presenza è globale: gli eventi delle guild aggiornano solo lo stato
+    in memoria e al massimo una chiamata a change_presence per finestra
+    applica il riepilogo, saltata se identica all'ultima inviata.
+    """
+
+    def __init__(self, window=PRESENCE_UPDATE_WINDOW):
+        self.window = window
+        self.bot = None
+        self.guilds = {}  # guild_id -> (titolo, in pausa)
+        self.last_sent = None
+        self.last_flush = float("-inf")
+        self.updates = 0
+        self.collapsed = 0
+        self.skipped = 0
+        self._handle = None
+
+    def report(self, bot, guild_id, title=None, paused=False):
+        """Registra lo stato di una guild; None come titolo se non suona nulla"""
+        self.bot = bot
+        if title:
+            self.guilds[guild_id] = (title[:120], paused)
+        else:
+            self.guilds.pop(guild_id, None)
+        self._schedule()
+
+    def forget(self, guild_id):
+        """Rimuove una guild dal riepilogo (player distrutto)"""
+        if self.guilds.pop(guild_id, None) is not None and self.bot:
+            self._schedule()
+
+    def refresh(self, bot):
+        """Reinvia la presenza anche se invariata (es. dopo una nuova sessione)"""
+        self.bot = bot
+        self.last_sent = None
+        self._schedule()
+
+    def summary(self):
+        """Attività e stato che riassumono tutte le guild"""
+        if not self.guilds:
+            return discord.Game(name=IDLE_NAME), discord.Status.idle
+
+        if len(self.guilds) == 1:
+            title, paused = next(iter(self.guilds.values()))
+            name = f"⏸️ {title}" if paused else f"🎵 {title}"
+        else:
+            name = f"🎵 Musica in {len(self.guilds)} server"
+        activity = discord.Activity(type=discord.ActivityType.listening, name=name)
+        return activity, discord.Status.online
+
+    def _schedule(self):
+        # Aggiornamento già programmato: l'evento confluisce in quello
+        if self._handle is not None:
+            self.collapsed += 1
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        delay = max(self.last_flush + self.window - time.monotonic(), 0)
+        self._handle = loop.call_later(delay, self._flush)
+
+    def _flush(self):
+        self._handle = None
+        self.last_flush = time.monotonic()
+
+        activity, status = self.summary()
+        key = (activity.type, activity.name, status)
+        if key == self.last_sent:
+            self.skipped += 1
+            return
+
+        self.last_sent = key
+        asyncio.create_task(self._send(activity, status))
+
+    async def _send(self, activity, status):
+        try:
+            await self.bot.change_presence(activity=activity, status=status)
+            self.updates += 1
+            metrics.inc("presence_updates_total")
+        except Exception as e:
+            # Al prossimo evento la presenza verrà reinviata
+            self.last_sent = None
+            print(f"Errore aggiornamento status: {e}")
+
+    def stats(self):
+        """Statistiche degli aggiornamenti di presenza"""
+        return {
+            "guilds": len(self.guilds),
+            "updates": self.updates,
+            "collapsed": self.collapsed,
+            "skipped": self.skipped,
+        }
+
+
+# Presenza condivisa da tutte le guild
+presence_aggregator = PresenceAggregator()
@@ -0,0 +1,60 @@
+import discord
+from config import PROGRESS_BAR_LENGTH
+
+from utils import format_timestamp
+
+# Restituito quando il progresso coincide con l'ultimo inviato
+UNCHANGED = object()
+
+
+class ProgressRenderer:
+    """Rendering del progresso di una traccia con le parti fisse precalcolate.
+
+    Durata formattata, segmenti della barra ed embed sono costruiti una volta
+    per traccia; a ogni tick resta solo da scegliere il segmento e formattare
+    il tempo trascorso, e se il risultato è uguale all'ultimo inviato il
+    rendering restituisce UNCHANGED.
+    """
+
+    def __init__(self, song, duration, length=PROGRESS_BAR_LENGTH):
+        self.duration = duration
+        self.length = length
+        self.hours = duration >= 3600
+        self.total = format_timestamp(duration, self.hours)
+        # Una barra per ogni posizione del cursore
+        self.bars = tuple(
+            "━" * filled + "◉" + "━" * (length - filled - 1) for filled in range(length)
+        )
+        self.sent = None  # ultimo rendering inviato con successo
+
+        self._embed = discord.Embed(
+            title="🎵 Now Playing",
+            description=f"**{song['title']}**",
+            color=0x1DB954,
+        )
+        if song.get("thumbnail"):
+            self._embed.set_thumbnail(url=song["thumbnail"])
+        self._embed.add_field(name="\u200b", value="\u200b", inline=False)
+
+    def time_text(self, elapsed):
+        return f"{format_timestamp(elapsed, self.hours)} / {self.total}"
+
+    def bar(self, elapsed):
+        """Barra con il tempo, es. ━━◉━━ 01:23 / 03:45"""
+        if self.duration <= 0:
+            return "━" * self.length + " 00:00 / 00:00"
+        filled = min(int(elapsed / self.duration * self.length), self.length - 1)
+        return f"{self.bars[filled]} {self.time_text(elapsed)}"
+
+    def render(self, status, elapsed):
+        """Rendering (stato, barra), o UNCHANGED se uguale all'ultimo inviato"""
+        render = (status, self.bar(elapsed))
+        if render == self.sent:
+            return UNCHANGED
+        return render
+
+    def embed(self, render):
+        """Embed della traccia aggiornato con il rendering"""
+        status, bar = render
+        self._embed.set_field_at(0, name=status, value=f"```{bar}```", inline=False)
+        return self._embed
@@ -0,0 +1,152 @@
+import asyncio
+import time
+
+import discord
+from config import (
+    PROGRESS_UPDATE_INTERVAL,
+    PROGRESS_GLOBAL_EDIT_RATE,
+    PROGRESS_SCHEDULER_TICK,
+)
+
+from metrics import metrics
+from progress_renderer import UNCHANGED
+from utils import get_bell_interval
+
+
+class ProgressScheduler:
+    """Unico scheduler per i messaggi di progresso di tutte le guild.
+
+    Rispetta un budget globale di modifiche al secondo (token bucket) e un
+    intervallo minimo per canale, salta le modifiche quando la barra
+    renderizzata non è cambiata e serve prima le guild con ascoltatori.
+    """
+
+    def __init__(
+        self,
+        edit_rate=PROGRESS_GLOBAL_EDIT_RATE,
+        channel_interval=PROGRESS_UPDATE_INTERVAL,
+        tick=PROGRESS_SCHEDULER_TICK,
+    ):
+        self.edit_rate = edit_rate
+        self.channel_interval = channel_interval
+        self.tick = tick
+        self.players = {}  # player -> prossimo aggiornamento (monotonic)
+        self.channel_next_edit = {}  # channel_id -> prima modifica consentita
+        self.in_flight = set()
+        self.tokens = edit_rate
+        self.edits = 0
+        self.skipped = 0
+        self.failures = 0
+        self._task = None
+
+    def register(self, player):
+        """Aggiunge un player agli aggiornamenti del progresso"""
+        self.players[player] = time.monotonic() + self.channel_interval
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def unregister(self, player):
+        self.players.pop(player, None)
+
+    async def _run(self):
+        """Loop centrale: distribuisce il budget di modifiche ai player in scadenza"""
+        last = time.monotonic()
+        while self.players:
+            await asyncio.sleep(self.tick)
+
+            now = time.monotonic()
+            self.tokens = min(self.edit_rate, self.tokens + (now - last) * self.edit_rate)
+            last = now
+
+            due = [
+                player
+                for player, due_at in self.players.items()
+                if due_at <= now and player not in self.in_flight
+            ]
+            # Prima le guild con ascoltatori, poi le più in ritardo
+            due.sort(key=lambda p: (not p.has_listeners(), self.players[p]))
+
+            for player in due:
+                try:
+                    self._process(player, now)
+                except Exception as e:
+                    print(f"Errore nello scheduler del progresso: {e}")
+                    self.unregister(player)
+
+        # Nessun player: dimentica i canali senza limiti ancora attivi
+        now = time.monotonic()
+        self.channel_next_edit = {
+            channel_id: next_edit
+            for channel_id, next_edit in self.channel_next_edit.items()
+            if next_edit > now
+        }
+
+    def _process(self, player, now):
+        if not player.progress_active():
+            self.unregister(player)
+            player.progress_message = None
+            return
+
+        render = player.render_progress()
+        next_due = now + get_bell_interval(player.get_position(), player.current_duration)
+
+        # Barra invariata: nessuna chiamata HTTP
+        if render is UNCHANGED:
+            self.skipped += 1
+            self.players[player] = next_due
+            return
+
+        channel_id = player.progress_message.channel.id
+        if self.tokens < 1 or self.channel_next_edit.get(channel_id, 0) > now:
+            return
+
+        self.tokens -= 1
+        self.channel_next_edit[channel_id] = now + self.channel_interval
+        self.players[player] = next_due
+        self.in_flight.add(player)
+        asyncio.create_task(self._edit(player, render))
+
+    async def _edit(self, player, render):
+        message = player.progress_message
+        renderer = player.progress_renderer
+        try:
+            with metrics.timer("progress_edit"):
+                await message.edit(embed=renderer.embed(render))
+            renderer.sent = render
+            self.edits += 1
+            metrics.inc("progress_edits_total")
+        except discord.NotFound:
+            # Messaggio cancellato, interrompe gli aggiornamenti
+            self.unregister(player)
+            player.progress_message = None
+        except discord.HTTPException as e:
+            self.failures += 1
+            metrics.inc("progress_edit_failures_total", status=e.status)
+            if e.status == 429:
+                retry_after = float(e.response.headers.get("Retry-After", 5))
+                self.channel_next_edit[message.channel.id] = (
+                    time.monotonic() + retry_after
+                )
+            else:
+                print(f"Errore aggiornamento progresso: {e}")
+                self.unregister(player)
+        except Exception as e:
+            self.failures += 1
+            metrics.inc("progress_edit_failures_total", status="error")
+            print(f"Errore aggiornamento progresso: {e}")
+            self.unregister(player)
+        finally:
+            self.in_flight.discard(player)
+
+    def stats(self):
+        """Statistiche dello scheduler"""
+        return {
+            "players": len(self.players),
+            "edits": self.edits,
+            "skipped": self.skipped,
+            "failures": self.failures,
+        }
+
+
+# Scheduler condiviso da tutte le guild
+progress_scheduler = ProgressScheduler()
@@ -0,0 +1,257 @@
+import asyncio
+import json
+import os
+
+from config import (
+    QUEUE_STATE_DIR,
+    QUEUE_CHECKPOINT_INTERVAL,
+    QUEUE_COMPACT_MIN_ENTRIES,
+)
+from track import Track
+
+
+class QueueJournal:
+    """Registro append-only delle code, un file JSON lines per guild.
+
+    Ogni modifica della coda aggiunge una riga (add, pop, clear, insert,
+    move, remove, reorder, current, position); al riavvio la coda si
+    ricostruisce rileggendo il file, solo quando la guild torna in un
+    canale vocale. Le posizioni dei brani in riproduzione sono salvate
+    periodicamente, per sopravvivere ai crash.
+    """
+
+    def __init__(
+        self,
+        directory=QUEUE_STATE_DIR,
+        checkpoint_interval=QUEUE_CHECKPOINT_INTERVAL,
+        compact_min=QUEUE_COMPACT_MIN_ENTRIES,
+    ):
+        self.directory = directory
+        self.checkpoint_interval = checkpoint_interval
+        self.compact_min = compact_min
+        self.enabled = bool(directory)
+        self._files = {}  # guild_id -> file aperto in append
+        self._entries = {}  # guild_id -> righe dall'ultima compattazione
+        self._playing = {}  # guild_id -> player con un brano corrente
+        self._positions = {}  # guild_id -> ultima posizione salvata
+        self._timer = None
+        self.writes = 0
+        self.restored = 0
+
+    def path(self, guild_id):
+        return os.path.join(self.directory, f"{guild_id}.jsonl")
+
+    def _append(self, guild_id, op, **data):
+        if not self.enabled or guild_id is None:
+            return
+        try:
+            file = self._files.get(guild_id)
+            if file is None:
+                # La cartella si crea alla prima scrittura, non all'import
+                os.makedirs(self.directory, exist_ok=True)
+                file = self._files[guild_id] = open(
+                    self.path(guild_id), "a", encoding="utf-8"
+                )
+            file.write(json.dumps({"op": op, **data}) + "\n")
+            # flush senza fsync: basta a sopravvivere al crash del processo
+            file.flush()
+            self._entries[guild_id] = self._entries.get(guild_id, 0) + 1
+            self.writes += 1
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Errore nel salvataggio della coda: {e}")
+
+    def add(self, guild_id, tracks):
+        """Registra le tracce aggiunte in fondo alla coda"""
+        if tracks:
+            self._append(guild_id, "add", tracks=[track.to_dict() for track in tracks])
+
+    def pop(self, guild_id):
+        """Registra la rimozione della traccia in testa"""
+        self._append(guild_id, "pop")
+
+    def clear(self, guild_id):
+        self._append(guild_id, "clear")
+
+    def insert(self, guild_id, index, tracks):
+        """Registra le tracce inserite prima della posizione `index`"""
+        if tracks:
+            self._append(
+                guild_id, "insert", index=index, tracks=[track.to_dict() for track in tracks]
+            )
+
+    def move(self, guild_id, source, target):
+        self._append(guild_id, "move", source=source, target=target)
+
+    def remove(self, guild_id, start, stop):
+        self._append(guild_id, "remove", start=start, stop=stop)
+
+    def reorder(self, guild_id, order):
+        """Registra la coda riordinata come posizioni precedenti (shuffle, duplicati)"""
+        self._append(guild_id, "reorder", order=order)
+
+    def current(self, player, position=0):
+        """Registra il brano corrente (o nessuno) della guild"""
+        guild_id = player.guild_id
+        song = player.current_song
+        self._append(
+            guild_id, "current", track=song.to_dict() if song else None, position=position
+        )
+        self._positions[guild_id] = position
+        if song:
+            self._playing[guild_id] = player
+            self._schedule_checkpoint()
+        else:
+            self._playing.pop(guild_id, None)
+
+    def position(self, player):
+        """Registra la posizione attuale del brano corrente"""
+        position = round(player.get_position(), 1)
+        if abs(position - self._positions.get(player.guild_id, -1)) < 1:
+            return
+        self._positions[player.guild_id] = position
+        self._append(player.guild_id, "position", position=position)
+
+    def maybe_compact(self, player):
+        """Riscrive il file come istantanea quando il log è molto più lungo della coda"""
+        guild_id = player.guild_id
+        entries = self._entries.get(guild_id, 0)
+        if entries < max(self.compact_min, 4 * len(player.queue)):
+            return
+
+        # Solo il file: i checkpoint del brano corrente continuano
+        self._close_file(guild_id)
+        temp_path = self.path(guild_id) + ".tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as file:
+                song = player.current_song
+                position = round(player.get_position(), 1)
+                file.write(
+                    json.dumps(
+                        {
+                            "op": "current",
+                            "track": song.to_dict() if song else None,
+                            "position": position,
+                        }
+                    )
+                    + "\n"
+                )
+                tracks = [track.to_dict() for track in player.queue]
+                file.write(json.dumps({"op": "add", "tracks": tracks}) + "\n")
+            os.replace(temp_path, self.path(guild_id))
+            self._entries[guild_id] = 2
+            self._positions[guild_id] = position
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Errore nella compattazione della coda: {e}")
+
+    def has_state(self, guild_id):
+        return self.enabled and os.path.exists(self.path(guild_id))
+
+    def restore(self, guild_id):
+        """Ricostruisce lo stato salvato e svuota il file.
+
+        Restituisce (brano corrente, posizione, coda); chi ripristina lo stato
+        lo riregistra con le normali operazioni della coda.
+        """
+        if not self.has_state(guild_id):
+            return None, 0, []
+
+        self.close(guild_id)
+        current, position, queue = None, 0, []
+        try:
+            with open(self.path(guild_id), encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Ultima riga troncata da un crash
+                        continue
+                    op = entry.get("op")
+                    if op == "add":
+                        queue.extend(entry["tracks"])
+                    elif op == "pop":
+                        if queue:
+                            queue.pop(0)
+                    elif op == "clear":
+                        queue = []
+                    elif op == "insert":
+                        queue[entry["index"]:entry["index"]] = entry["tracks"]
+                    elif op == "move":
+                        if entry["source"] < len(queue):
+                            queue.insert(entry["target"], queue.pop(entry["source"]))
+                    elif op == "remove":
+                        del queue[entry["start"]:entry["stop"]]
+                    elif op == "reorder":
+                        queue = [queue[index] for index in entry["order"] if index < len(queue)]
+                    elif op == "current":
+                        current, position = entry["track"], entry["position"]
+                    elif op == "position":
+                        position = entry["position"]
+        except OSError as e:
+            print(f"Errore nel ripristino della coda: {e}")
+        finally:
+            self.discard(guild_id)
+
+        if current or queue:
+            self.restored += 1
+        return (
+            Track.from_dict(current) if current else None,
+            position,
+            [Track.from_dict(track) for track in queue],
+        )
+
+    def _close_file(self, guild_id):
+        file = self._files.pop(guild_id, None)
+        if file:
+            file.close()
+
+    def close(self, guild_id):
+        """Chiude il file della guild, lasciando lo stato su disco"""
+        self._close_file(guild_id)
+        self._playing.pop(guild_id, None)
+
+    def discard(self, guild_id):
+        """Elimina lo stato salvato della guild"""
+        self.close(guild_id)
+        self._entries.pop(guild_id, None)
+        self._positions.pop(guild_id, None)
+        if not self.enabled:
+            return
+        try:
+            os.remove(self.path(guild_id))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Errore nella rimozione della coda salvata: {e}")
+
+    def _schedule_checkpoint(self):
+        if self._timer is not None or not self._playing:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._timer = loop.call_later(self.checkpoint_interval, self._checkpoint)
+
+    def _checkpoint(self):
+        """Salva la posizione dei brani in riproduzione"""
+        self._timer = None
+        for player in list(self._playing.values()):
+            try:
+                if player.voice_client and player.voice_client.is_playing():
+                    self.position(player)
+                    self.maybe_compact(player)
+            except Exception as e:
+                print(f"Errore nel checkpoint della coda: {e}")
+        self._schedule_checkpoint()
+
+    def stats(self):
+        """Statistiche della persistenza"""
+        return {
+            "open": len(self._files),
+            "writes": self.writes,
+            "restored": self.restored,
+        }
+
+
+# Registro condiviso da tutte le guild
+queue_journal = QueueJournal()
@@ -0,0 +1,214 @@
+import asyncio
+import re
+import threading
+import unicodedata
+from collections import OrderedDict, defaultdict
+from difflib import SequenceMatcher
+from itertools import islice
+
+from config import (
+    SEARCH_INDEX_THRESHOLD,
+    SEARCH_INDEX_MAX_ENTRIES,
+    SEARCH_INDEX_MAX_CANDIDATES,
+)
+
+METADATA_FIELDS = ("id", "url", "title", "thumbnail", "duration")
+
+
+def normalize(text):
+    """Minuscolo, senza accenti né punteggiatura e con spazi singoli"""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(re.findall(r"\w+", text))
+
+
+def _token_similarity(matcher, key_tokens):
+    """Somiglianza migliore del token del matcher con i token della chiave (0 se troppo diversa)"""
+    token = matcher.b
+    if token in key_tokens:
+        return 1.0
+    best = 0.0
+    for other in key_tokens:
+        # Lunghezze troppo diverse non possono superare la soglia
+        if abs(len(token) - len(other)) > len(token) // 4 + 1:
+            continue
+        matcher.set_seq1(other)
+        if matcher.quick_ratio() > best:
+            best = max(best, matcher.ratio())
+    return best if best >= 0.8 else 0.0
+
+
+def _edits(text, other):
+    """Caratteri da cambiare per passare da un testo all'altro (stima)"""
+    blocks = SequenceMatcher(None, text, other, autojunk=False).get_matching_blocks()
+    return max(len(text), len(other)) - sum(block.size for block in blocks)
+
+
+class SearchIndex:
+    """Indice locale delle ricerche già risolte e dei titoli delle tracce.
+
+    Le chiavi sono query e titoli normalizzati; i candidati si trovano dai
+    prefissi dei token (tollerando errori di battitura) e il punteggio unisce
+    la copertura dei token della query con quella dei token della chiave.
+    I titoli servono solo a proporre candidati: una richiesta si risolve in
+    locale solo se quasi identica a una query già risolta.
+    Si costruisce in un thread alla prima ricerca (load) dalle voci della
+    cache delle tracce.
+    """
+
+    def __init__(
+        self,
+        loader=None,
+        threshold=SEARCH_INDEX_THRESHOLD,
+        max_entries=SEARCH_INDEX_MAX_ENTRIES,
+        max_candidates=SEARCH_INDEX_MAX_CANDIDATES,
+    ):
+        self.loader = loader  # restituisce [(query o None, metadati)]
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_candidates = max_candidates
+        self.entries = OrderedDict()  # chiave normalizzata -> metadati
+        self.queries = set()  # chiavi che vengono da query risolte, non da titoli
+        self.prefixes = defaultdict(set)  # prime 3 lettere di un token -> chiavi
+        self.hits = 0
+        self.misses = 0
+        self._loaded = loader is None
+        self._loading = None  # caricamento in corso nel thread
+        self._lock = threading.Lock()
+
+    def add(self, text, metadata, query=False):
+        key = normalize(text or "")
+        if not key:
+            return
+        with self._lock:
+            self.entries[key] = metadata
+            if query:
+                self.queries.add(key)
+            self.entries.move_to_end(key)
+            for token in key.split():
+                self.prefixes[token[:3]].add(key)
+            while len(self.entries) > self.max_entries:
+                self._forget(next(iter(self.entries)))
+
+    def add_track(self, query, song):
+        """Indicizza la query che ha prodotto la traccia e il suo titolo"""
+        metadata = {field: song.get(field) for field in METADATA_FIELDS}
+        if query and not query.startswith("http"):
+            self.add(query, metadata, query=True)
+        self.add(metadata["title"], metadata)
+
+    def _forget(self, key):
+        del self.entries[key]
+        self.queries.discard(key)
+        for token in key.split():
+            keys = self.prefixes.get(token[:3])
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.prefixes[token[:3]]
+
+    async def load(self):
+        """Costruisce l'indice dalla cache senza bloccare l'event loop; da attendere prima di cercare"""
+        if self._loaded:
+            return
+        if self._loading is None:
+            self._loading = asyncio.get_running_loop().run_in_executor(None, self._load)
+        # Un comando annullato non interrompe il caricamento condiviso
+        await asyncio.shield(self._loading)
+
+    def _load(self):
+        try:
+            for query, metadata in self.loader():
+                if query:
+                    self.add(query, metadata, query=True)
+                self.add(metadata.get("title"), metadata)
+        except Exception as e:
+            print(f"Errore nella costruzione dell'indice di ricerca: {e}")
+        finally:
+            self._loaded = True
+
+    def search(self, query, limit=5):
+        """Le `limit` tracce più simili alla query, come [(punteggio, metadati)]"""
+        normalized = normalize(query)
+        tokens = normalized.split()
+        if not tokens:
+            return []
+
+        with self._lock:
+            candidates = [(key, self.entries[key]) for key in self._candidates(set(tokens))]
+
+        # Un matcher per token: SequenceMatcher prepara solo la seconda sequenza
+        matchers = [SequenceMatcher(None, b=token) for token in tokens]
+        best = {}
+        for key, metadata in candidates:
+            score = self._score(normalized, matchers, key)
+            if score < 0.5:
+                continue
+            url = metadata.get("url")
+            if score > best.get(url, (0,))[0]:
+                best[url] = (score, metadata)
+        return sorted(best.values(), key=lambda item: item[0], reverse=True)[:limit]
+
+    def _candidates(self, tokens, queries_only=False):
+        """Chiavi da confrontare, ordinate per numero di prefissi in comune.
+
+        I prefissi molto comuni (es. "the") si usano solo per ordinare i
+        candidati trovati con quelli più rari, come parole vuote.
+        """
+        buckets = sorted(
+            (self.prefixes.get(token[:3], set()) for token in tokens), key=len
+        )
+        rare = [bucket for bucket in buckets if len(bucket) <= self.max_candidates * 5]
+        if rare:
+            found = set().union(*rare)
+        else:
+            found = set(islice(buckets[0], self.max_candidates * 5))
+        if queries_only:
+            found &= self.queries
+
+        shared = {key: sum(key in bucket for bucket in buckets) for key in found}
+        return sorted(shared, key=shared.get, reverse=True)[: self.max_candidates]
+
+    def _score(self, normalized, matchers, key):
+        if normalized == key:
+            return 1.0
+        key_tokens = set(key.split())
+        matched = sum(_token_similarity(matcher, key_tokens) for matcher in matchers)
+        # Quanto della query è nella chiave e quanto della chiave è nella query
+        coverage = matched / len(matchers)
+        precision = min(matched / len(key_tokens), 1.0)
+        return 0.75 * coverage + 0.25 * precision
+
+    def lookup(self, query):
+        """Metadati della traccia se la query è quasi identica a una già risolta.
+
+        Gli errori di battitura tollerati crescono con la lunghezza: con la
+        soglia 0.85 una query di 11 lettere ne ammette uno, una di 9 nessuno.
+        """
+        normalized = normalize(query)
+        tokens = normalized.split()
+        best = None
+        if tokens:
+            with self._lock:
+                candidates = [
+                    (key, self.entries[key])
+                    for key in self._candidates(set(tokens), queries_only=True)
+                ]
+            # L'ordine delle parole non conta
+            ordered = " ".join(sorted(tokens))
+            for key, metadata in candidates:
+                edits = _edits(ordered, " ".join(sorted(key.split())))
+                if edits <= len(key) * (1 - self.threshold) and (
+                    best is None or edits < best[0]
+                ):
+                    best = (edits, metadata)
+
+        if best is not None:
+            self.hits += 1
+            return best[1]
+        self.misses += 1
+        return None
+
+    def stats(self):
+        """Statistiche dell'indice"""
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
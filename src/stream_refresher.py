@@ -0,0 +1,123 @@
+import asyncio
+import time
+
+from config import (
+    STREAM_EXPIRY_MARGIN,
+    STREAM_REFRESH_INTERVAL,
+    STREAM_REFRESH_AHEAD,
+    STREAM_REFRESH_LOOKAHEAD,
+    STREAM_REFRESH_BATCH,
+)
+from extraction_service import extraction_service
+from metrics import metrics
+from ytdl_source import resolve_stream
+
+
+class StreamRefresher:
+    """Riestrae in background gli stream in coda prima che scadano.
+
+    Per ogni guild in riproduzione stima quando partiranno le prime tracce
+    della coda e riestrae, a piccoli blocchi e solo con il pool di estrazione
+    libero, quelle il cui stream scadrebbe prima o poco dopo l'avvio.
+    """
+
+    def __init__(
+        self,
+        interval=STREAM_REFRESH_INTERVAL,
+        ahead=STREAM_REFRESH_AHEAD,
+        lookahead=STREAM_REFRESH_LOOKAHEAD,
+        batch=STREAM_REFRESH_BATCH,
+    ):
+        self.interval = interval
+        self.ahead = ahead
+        self.lookahead = lookahead
+        self.batch = batch
+        self.players = {}  # guild_id -> player con un brano corrente
+        self.refreshed = 0
+        self.failed = 0
+        self.deferred = 0  # controlli rinviati per pool occupato
+        self._handle = None
+        self._task = None
+
+    def watch(self, player):
+        """Controlla la coda del player finché ha un brano corrente"""
+        self.players[player.guild_id] = player
+        self._schedule()
+
+    def forget(self, guild_id):
+        self.players.pop(guild_id, None)
+
+    def due(self, player, now=None):
+        """Tracce in testa alla coda il cui stream scade prima dell'avvio stimato"""
+        now = time.time() if now is None else now
+        # In pausa la posizione non avanza: l'avvio stimato si sposta con il tempo
+        start = now + max(player.current_duration - player.get_position(), 0)
+        songs = []
+        for song in player.queue.page(0, self.lookahead):
+            expires_at = song.get("expires_at")
+            if (
+                song.get("stream_url")
+                and expires_at
+                and expires_at - STREAM_EXPIRY_MARGIN <= start + self.ahead
+            ):
+                songs.append((expires_at, song, player))
+            start += song.get("duration") or 0
+        return songs
+
+    def _schedule(self):
+        if self._handle is not None or not self.players:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._handle = loop.call_later(self.interval, self._run)
+
+    def _run(self):
+        self._handle = None
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.refresh())
+        self._schedule()
+
+    async def refresh(self):
+        """Riestrae un blocco di stream, i più vicini alla scadenza per primi"""
+        for guild_id, player in list(self.players.items()):
+            if not player.current_song:
+                self.forget(guild_id)
+
+        due = []
+        now = time.time()
+        for player in list(self.players.values()):
+            due.extend(self.due(player, now))
+        due.sort(key=lambda item: item[0])
+
+        for _, song, player in due[: self.batch]:
+            # Bassa priorità: cede il passo alle richieste degli utenti
+            if extraction_service.stats()["pending"]:
+                self.deferred += 1
+                return
+            try:
+                await resolve_stream(song, force=True)
+            except Exception as e:
+                self.failed += 1
+                metrics.error("stream_refresh", e)
+                continue
+            self.refreshed += 1
+            metrics.inc("stream_refreshes_total")
+            # Un FFmpeg già avviato per questa traccia usa il vecchio stream
+            if song is player.prefetch_song and player.prefetched_source:
+                player.invalidate_prefetch()
+                player.schedule_prefetch()
+
+    def stats(self):
+        """Statistiche del refresh degli stream"""
+        return {
+            "players": len(self.players),
+            "refreshed": self.refreshed,
+            "failed": self.failed,
+            "deferred": self.deferred,
+        }
+
+
+# Refresh condiviso da tutte le guild
+stream_refresher = StreamRefresher()
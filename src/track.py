@@ -0,0 +1,316 @@
+import json
+import random
+import sys
+import tempfile
+from collections import deque
+from itertools import islice
+
+from config import QUEUE_SPILL_THRESHOLD, QUEUE_SPILL_BATCH
+
+# Header HTTP identici condivisi tra tutte le tracce
+_shared_headers = {}
+
+
+def _share_headers(headers):
+    if not headers:
+        return headers
+    key = tuple(sorted(headers.items()))
+    return _shared_headers.setdefault(key, headers)
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class Track:
+    """Traccia compatta: slot fissi, stringhe internate e miniatura opzionale.
+
+    Supporta anche l'accesso tipo dizionario (track["title"], track.get(...))
+    usato nel resto del codice.
+    """
+
+    __slots__ = (
+        "id",
+        "url",
+        "title",
+        "_thumbnail",
+        "duration",
+        "stream_url",
+        "http_headers",
+        "expires_at",
+        "acodec",
+    )
+    FIELDS = (
+        "id",
+        "url",
+        "title",
+        "thumbnail",
+        "duration",
+        "stream_url",
+        "http_headers",
+        "expires_at",
+        "acodec",
+    )
+
+    def __init__(
+        self,
+        url,
+        title="Titolo sconosciuto",
+        id=None,
+        thumbnail=None,
+        duration=0,
+        stream_url=None,
+        http_headers=None,
+        expires_at=None,
+        acodec=None,
+    ):
+        self.id = _intern(id)
+        self.url = _intern(url)
+        self.title = _intern(title)
+        self.duration = duration or 0
+        self.thumbnail = thumbnail
+        self.stream_url = stream_url
+        self.http_headers = _share_headers(http_headers)
+        self.expires_at = expires_at
+        self.acodec = _intern(acodec)
+
+    @property
+    def thumbnail(self):
+        # Le miniature di YouTube si ricavano dall'ID, senza salvarle
+        if self._thumbnail is None and self.id and "youtube.com" in self.url:
+            return f"https://i.ytimg.com/vi/{self.id}/hqdefault.jpg"
+        return self._thumbnail
+
+    @thumbnail.setter
+    def thumbnail(self, value):
+        if value and self.id and "i.ytimg.com/vi" in value:
+            value = None
+        self._thumbnail = value
+
+    def __getitem__(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        if key == "http_headers":
+            value = _share_headers(value)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.FIELDS
+
+    def get(self, key, default=None):
+        if key not in self.FIELDS:
+            return default
+        value = getattr(self, key)
+        return default if value is None else value
+
+    def update(self, values):
+        for key, value in values.items():
+            self[key] = value
+
+    def to_dict(self):
+        data = {field: getattr(self, field) for field in self.FIELDS}
+        data["thumbnail"] = self._thumbnail
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{k: v for k, v in data.items() if k in cls.FIELDS})
+
+    def __repr__(self):
+        return f"Track({self.title!r}, {self.url!r})"
+
+
+class TrackQueue:
+    """Coda delle tracce con paginazione O(limit).
+
+    Oltre QUEUE_SPILL_THRESHOLD elementi (se impostato) le tracce in eccesso
+    vengono scritte su un file temporaneo e ricaricate a blocchi quando la
+    parte in memoria si svuota.
+    """
+
+    def __init__(self, spill_threshold=QUEUE_SPILL_THRESHOLD, batch=QUEUE_SPILL_BATCH):
+        self.spill_threshold = spill_threshold
+        self.batch = batch
+        self._memory = deque()
+        self._spill = None  # file JSON lines
+        self._spill_count = 0
+        self._read_offset = 0
+
+    def __len__(self):
+        return len(self._memory) + self._spill_count
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __iter__(self):
+        yield from self._memory
+        if self._spill_count:
+            yield from self._iter_spilled()
+
+    def __getitem__(self, index):
+        if 0 <= index < len(self._memory):
+            return self._memory[index]
+        if index < 0 or index >= len(self):
+            raise IndexError("indice fuori dalla coda")
+        return next(islice(iter(self), index, None))
+
+    def append(self, track):
+        self.extend([track])
+
+    def extend(self, tracks):
+        for track in tracks:
+            if self._spill_count or (
+                self.spill_threshold and len(self._memory) >= self.spill_threshold
+            ):
+                self._write_spilled(track)
+            else:
+                self._memory.append(track)
+
+    def popleft(self):
+        if not self._memory:
+            self._refill()
+        track = self._memory.popleft()
+        self._top_up()
+        return track
+
+    def insert(self, index, tracks):
+        """Inserisce le tracce prima della posizione `index`"""
+        tracks = list(tracks)
+        if index >= len(self):
+            self.extend(tracks)
+        elif index <= len(self._memory):
+            # Una rotazione invece di un deque.insert per traccia
+            self._memory.rotate(-index)
+            self._memory.extendleft(reversed(tracks))
+            self._memory.rotate(index)
+        else:
+            queue = list(self)
+            queue[index:index] = tracks
+            self._replace(queue)
+
+    def move(self, source, target):
+        """Sposta la traccia in posizione `source` a `target` e la restituisce"""
+        if not (0 <= source < len(self) and 0 <= target < len(self)):
+            raise IndexError("indice fuori dalla coda")
+        if source < len(self._memory) and target < len(self._memory):
+            track = self._memory[source]
+            del self._memory[source]
+            self._memory.insert(target, track)
+        else:
+            queue = list(self)
+            track = queue.pop(source)
+            queue.insert(target, track)
+            self._replace(queue)
+        return track
+
+    def remove_range(self, start, stop):
+        """Rimuove le tracce da `start` a `stop` escluso e le restituisce"""
+        start, stop = max(start, 0), min(stop, len(self))
+        if start >= stop:
+            return []
+        if stop <= len(self._memory):
+            self._memory.rotate(-start)
+            removed = [self._memory.popleft() for _ in range(stop - start)]
+            self._memory.rotate(start)
+            self._top_up()
+        else:
+            queue = list(self)
+            removed = queue[start:stop]
+            del queue[start:stop]
+            self._replace(queue)
+        return removed
+
+    def reorder(self, order):
+        """Ricostruisce la coda con le tracce nelle posizioni `order`, nell'ordine dato"""
+        tracks = list(self)
+        self._replace([tracks[index] for index in order])
+
+    def shuffle(self, rng=random):
+        """Mescola la coda; restituisce l'ordine applicato"""
+        order = rng.sample(range(len(self)), len(self))
+        self.reorder(order)
+        return order
+
+    def dedupe(self):
+        """Rimuove le tracce dello stesso video già presenti prima; restituisce le posizioni rimaste"""
+        seen = set()
+        order = []
+        for index, track in enumerate(self):
+            key = track.id or track.url
+            if key not in seen:
+                seen.add(key)
+                order.append(index)
+        if len(order) < len(self):
+            self.reorder(order)
+        return order
+
+    def page(self, start=0, limit=5):
+        """Restituisce `limit` tracce a partire da `start` senza copiare la coda"""
+        return list(islice(iter(self), start, start + limit))
+
+    def clear(self):
+        self._memory.clear()
+        if self._spill:
+            self._spill.close()
+        self._spill = None
+        self._spill_count = 0
+        self._read_offset = 0
+
+    def _replace(self, tracks):
+        """Sostituisce il contenuto rispettando la soglia di scrittura su disco"""
+        self.clear()
+        self.extend(tracks)
+
+    def _write_spilled(self, track):
+        if self._spill is None:
+            self._spill = tempfile.TemporaryFile(mode="w+", encoding="utf-8")
+        self._spill.seek(0, 2)
+        self._spill.write(json.dumps(track.to_dict()) + "\n")
+        self._spill_count += 1
+
+    def _iter_spilled(self):
+        """Tracce su disco lette una alla volta, senza spostare la lettura della coda"""
+        offset = self._read_offset
+        for _ in range(self._spill_count):
+            self._spill.seek(offset)
+            line = self._spill.readline()
+            if not line:
+                return
+            offset = self._spill.tell()
+            yield Track.from_dict(json.loads(line))
+
+    def _read_spilled(self, count):
+        self._spill.seek(self._read_offset)
+        tracks = []
+        for _ in range(count):
+            line = self._spill.readline()
+            if not line:
+                break
+            tracks.append(Track.from_dict(json.loads(line)))
+        self._read_offset = self._spill.tell()
+        self._spill_count -= len(tracks)
+        return tracks
+
+    def _top_up(self):
+        """Dopo una rimozione tiene in memoria almeno un blocco, se ci sono tracce su disco.
+
+        Così la testa della coda resta lo stesso oggetto tra due accessi.
+        """
+        if self._spill_count and len(self._memory) < self.batch:
+            self._refill()
+
+    def _refill(self):
+        """Ricarica in memoria il prossimo blocco di tracce dal disco"""
+        if not self._spill_count:
+            return
+        self._memory.extend(self._read_spilled(min(self.batch, self._spill_count)))
+        if not self._spill_count:
+            # File esaurito: lo chiude per liberare spazio
+            self._spill.close()
+            self._spill = None
+            self._read_offset = 0
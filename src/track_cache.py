@@ -0,0 +1,314 @@
+import asyncio
+import json
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from config import (
+    CACHE_DB_PATH,
+    CACHE_MEMORY_SIZE,
+    CACHE_MAX_ENTRIES,
+    CACHE_METADATA_TTL,
+    STREAM_EXPIRY_MARGIN,
+)
+from track import Track
+
+METADATA_FIELDS = ("id", "url", "title", "thumbnail", "duration")
+STREAM_FIELDS = ("stream_url", "http_headers", "expires_at", "acodec")
+
+
+def cache_key(query):
+    """Normalizza una query o un URL in una chiave di cache"""
+    query = query.strip()
+    if query.startswith("http"):
+        return query
+    return f"search:{' '.join(query.lower().split())}"
+
+
+class TrackCache:
+    """Cache delle estrazioni: LRU in memoria davanti a un archivio SQLite.
+
+    I metadati (titolo, durata, ...) sono indicizzati per query e per URL,
+    gli stream sono salvati a parte e scadono insieme al loro URL.
+    Sull'event loop si consulta solo la LRU in memoria: le letture su disco
+    (ricerche per chiave in WAL, che non attendono le scritture) girano in un
+    thread, le scritture passano da un thread dedicato che le raggruppa in
+    un'unica transazione. Gli errori del database non interrompono le
+    estrazioni: la cache resta valida in memoria.
+    """
+
+    def __init__(
+        self,
+        path=CACHE_DB_PATH,
+        memory_size=CACHE_MEMORY_SIZE,
+        max_entries=CACHE_MAX_ENTRIES,
+        metadata_ttl=CACHE_METADATA_TTL,
+    ):
+        self.path = path
+        self.memory_size = memory_size
+        self.max_entries = max_entries
+        self.metadata_ttl = metadata_ttl
+        self.metadata = OrderedDict()  # chiave -> (metadati, salvato_il)
+        self.streams = OrderedDict()  # url -> dati dello stream
+        self.hits = 0
+        self.misses = 0
+        self.stream_hits = 0
+        self.stream_misses = 0
+        self.disk_entries = 0
+        self.disk_errors = 0
+        self._lock = threading.Lock()  # LRU in memoria e contatori
+        self._db_lock = threading.Lock()  # connessione di lettura
+        self._db = None  # connessione di sola lettura, usata nei thread
+        self._writes = queue.SimpleQueue()
+        self._writer = None
+
+        if path:
+            try:
+                db = sqlite3.connect(path)
+                db.executescript(
+                    """
+                    PRAGMA journal_mode = WAL;
+                    CREATE TABLE IF NOT EXISTS tracks (
+                        key TEXT PRIMARY KEY,
+                        data TEXT NOT NULL,
+                        stored_at REAL NOT NULL,
+                        accessed_at REAL NOT NULL
+                    );
+                    CREATE INDEX IF NOT EXISTS tracks_accessed ON tracks (accessed_at);
+                    CREATE TABLE IF NOT EXISTS streams (
+                        url TEXT PRIMARY KEY,
+                        data TEXT NOT NULL,
+                        expires_at REAL NOT NULL
+                    );
+                    CREATE INDEX IF NOT EXISTS streams_expires ON streams (expires_at);
+                    """
+                )
+                self.disk_entries = db.execute("SELECT COUNT(*) FROM tracks").fetchone()[0]
+                db.close()
+                # Timeout breve: con il database occupato la lettura conta come miss
+                self._db = sqlite3.connect(path, timeout=0.05, check_same_thread=False)
+            except sqlite3.Error as e:
+                print(f"Cache su disco non disponibile: {e}")
+                self._db = None
+
+    async def get_song(self, query):
+        """Restituisce una copia della traccia in cache per la query, o None"""
+        metadata = await self.get_metadata(cache_key(query))
+        if metadata is None:
+            return None
+
+        song = Track.from_dict(metadata)
+        song.update(await self.get_stream(song.url) or {})
+        return song
+
+    def put_song(self, query, song):
+        """Salva metadati e stream di una traccia risolta"""
+        metadata = {field: song.get(field) for field in METADATA_FIELDS}
+        self.put_metadata(cache_key(query), metadata)
+        if cache_key(song["url"]) != cache_key(query):
+            self.put_metadata(cache_key(song["url"]), metadata)
+        if song.get("stream_url"):
+            self.put_stream(song)
+
+    async def get_metadata(self, key):
+        """Cerca i metadati prima in memoria e poi su disco"""
+        with self._lock:
+            entry = self.metadata.get(key)
+        if entry is None:
+            row = await self._read("SELECT data, stored_at FROM tracks WHERE key = ?", (key,))
+            if row:
+                entry = (json.loads(row[0]), row[1])
+
+        now = time.time()
+        with self._lock:
+            # Una scrittura arrivata durante la lettura è più recente del disco
+            entry = self.metadata.get(key, entry)
+            if entry is None or now - entry[1] > self.metadata_ttl:
+                self.misses += 1
+                return None
+
+            self._remember(self.metadata, key, entry)
+            self.hits += 1
+        self._write("touch", key, now)
+        return entry[0]
+
+    def put_metadata(self, key, metadata):
+        now = time.time()
+        with self._lock:
+            self._remember(self.metadata, key, (metadata, now))
+        self._write("track", key, json.dumps(metadata), now)
+
+    async def _read(self, sql, params=()):
+        """Ricerca su disco in un thread; None se il disco è disattivato o non risponde"""
+        if not self._db:
+            return None
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self._read_row, sql, params
+        )
+
+    def _read_row(self, sql, params):
+        try:
+            with self._db_lock:
+                return self._db.execute(sql, params).fetchone()
+        except sqlite3.Error as e:
+            self.disk_errors += 1
+            print(f"Errore in lettura dalla cache su disco: {e}")
+            return None
+
+    def _write(self, *operation):
+        """Accoda una scrittura per il thread del disco, avviandolo se serve"""
+        if not self._db:
+            return
+        self._writes.put(operation)
+        if self._writer is None:
+            self._writer = threading.Thread(
+                target=self._write_loop, name="track-cache", daemon=True
+            )
+            self._writer.start()
+
+    def _write_loop(self):
+        """Thread del disco: esegue le scritture in attesa in un'unica transazione"""
+        try:
+            db = sqlite3.connect(self.path, timeout=5)
+        except sqlite3.Error as e:
+            print(f"Cache su disco non disponibile: {e}")
+            self._db = None
+            return
+
+        while True:
+            batch = [self._writes.get()]
+            while len(batch) < 500:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._apply(db, [op for op in batch if op[0] != "flush"])
+            except sqlite3.Error as e:
+                # Il batch va perso, ma le voci restano nella LRU in memoria
+                db.rollback()
+                self.disk_errors += 1
+                print(f"Errore in scrittura nella cache su disco: {e}")
+            for kind, *args in batch:
+                if kind == "flush":
+                    args[0].set()
+
+    def _apply(self, db, batch):
+        stored = False
+        for kind, *args in batch:
+            if kind == "track":
+                key, data, now = args
+                db.execute("INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?)", (key, data, now, now))
+                stored = True
+            elif kind == "touch":
+                db.execute("UPDATE tracks SET accessed_at = ? WHERE key = ?", (args[1], args[0]))
+            elif kind == "stream":
+                db.execute("INSERT OR REPLACE INTO streams VALUES (?, ?, ?)", args)
+
+        if stored:
+            count = db.execute("SELECT COUNT(*) FROM tracks").fetchone()[0]
+            if count > self.max_entries:
+                # Elimina solo le voci in eccesso, le meno usate (indice su accessed_at)
+                db.execute(
+                    "DELETE FROM tracks WHERE key IN "
+                    "(SELECT key FROM tracks ORDER BY accessed_at LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+                count = self.max_entries
+            self.disk_entries = count
+        if any(kind == "stream" for kind, *_ in batch):
+            db.execute("DELETE FROM streams WHERE expires_at <= ?", (time.time(),))
+        db.commit()
+
+    def flush(self, timeout=5):
+        """Attende che le scritture accodate finora siano su disco"""
+        if self._writer is None:
+            return
+        done = threading.Event()
+        self._writes.put(("flush", done))
+        done.wait(timeout)
+
+    def known_tracks(self):
+        """Metadati validi in cache come [(query o None, metadati)], per gli indici.
+
+        Legge tutta la tabella: va eseguita in un thread, con una connessione
+        propria per non bloccare le letture per chiave.
+        """
+        cutoff = time.time() - self.metadata_ttl
+        rows = None
+        if self._db:
+            try:
+                db = sqlite3.connect(self.path, timeout=5)
+                try:
+                    rows = db.execute(
+                        "SELECT key, data FROM tracks WHERE stored_at > ?", (cutoff,)
+                    ).fetchall()
+                finally:
+                    db.close()
+            except sqlite3.Error as e:
+                self.disk_errors += 1
+                print(f"Errore in lettura dalla cache su disco: {e}")
+        if rows is not None:
+            entries = [(key, json.loads(data)) for key, data in rows]
+        else:
+            with self._lock:
+                entries = [
+                    (key, metadata)
+                    for key, (metadata, stored_at) in self.metadata.items()
+                    if stored_at > cutoff
+                ]
+
+        return [
+            (key[len("search:"):] if key.startswith("search:") else None, metadata)
+            for key, metadata in entries
+        ]
+
+    async def get_stream(self, url):
+        """Restituisce lo stream in cache se non è prossimo alla scadenza"""
+        with self._lock:
+            stream = self.streams.get(url)
+        if stream is None:
+            row = await self._read("SELECT data FROM streams WHERE url = ?", (url,))
+            if row:
+                stream = json.loads(row[0])
+
+        now = time.time()
+        with self._lock:
+            stream = self.streams.get(url, stream)
+            if stream is None or stream["expires_at"] - STREAM_EXPIRY_MARGIN <= now:
+                self.streams.pop(url, None)
+                self.stream_misses += 1
+                return None
+
+            self._remember(self.streams, url, stream)
+            self.stream_hits += 1
+            return dict(stream)
+
+    def put_stream(self, song):
+        stream = {field: song.get(field) for field in STREAM_FIELDS}
+        with self._lock:
+            self._remember(self.streams, song["url"], stream)
+        self._write("stream", song["url"], json.dumps(stream), stream["expires_at"])
+
+    def _remember(self, entries, key, value):
+        """Inserisce nella LRU in memoria rispettando la dimensione massima"""
+        entries[key] = value
+        entries.move_to_end(key)
+        while len(entries) > self.memory_size:
+            entries.popitem(last=False)
+
+    def stats(self):
+        """Statistiche della cache"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "stream_hits": self.stream_hits,
+                "stream_misses": self.stream_misses,
+                "memory_entries": len(self.metadata),
+                "memory_streams": len(self.streams),
+                "disk_entries": self.disk_entries,
+                "disk_errors": self.disk_errors,
+            }
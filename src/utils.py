@@ -1,49 +1,23 @@
-import asyncio
-import time
 import math
 
-from config import AUTO_DISCONNECT_TIMEOUT
-
-# Dizionario globale per i music players
-music_players = {}
-
-
-def get_music_player(guild_id):
-    """Ottiene o crea un music player per una guild"""
-    from music_player import MusicPlayer
-
-    if guild_id not in music_players:
-        music_players[guild_id] = MusicPlayer()
-    return music_players[guild_id]
-
-
-async def auto_disconnect_check(bot):
-    """Controlla periodicamente se disconnettere il bot dai canali vuoti"""
-    while True:
-        try:
-            for guild_id, player in list(music_players.items()):
-                if player.voice_client and player.voice_client.is_connected():
-                    channel = player.voice_client.channel
-                    real_members = [m for m in channel.members if not m.bot]
-
-                    if len(real_members) == 0:
-                        if player.disconnect_timer is None:
-                            player.disconnect_timer = time.time()
-                        elif (
-                            time.time() - player.disconnect_timer
-                            > AUTO_DISCONNECT_TIMEOUT
-                        ):
-                            await player.voice_client.disconnect()
-                            player.cleanup()
-                            await player.update_bot_status(bot)
-                            print(f"Auto-disconnesso da {guild_id} per inattività")
-                    else:
-                        player.disconnect_timer = None
-
-            await asyncio.sleep(10)
-        except Exception as e:
-            print(f"Errore auto-disconnect: {e}")
-            await asyncio.sleep(10)
+
+def parse_timestamp(text):
+    """Converte "90", "1:30" o "1:02:03" in secondi"""
+    parts = text.strip().split(":")
+    if not 1 <= len(parts) <= 3 or not all(part.isdigit() for part in parts):
+        raise ValueError(f"Posizione non valida: {text}")
+    seconds = 0
+    for part in parts:
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+
+def format_timestamp(seconds, hours=False):
+    """Formatta i secondi come MM:SS, o HH:MM:SS se richiesto o oltre l'ora"""
+    seconds = int(seconds)
+    if hours or seconds >= 3600:
+        return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+    return f"{seconds // 60:02d}:{seconds % 60:02d}"
 
 
 def get_bell_interval(t, duration, min_interval=1.0, max_interval=15.0):
@@ -1,84 +1,383 @@
 import asyncio
-import yt_dlp
+import shlex
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+
 import discord
-from config import YTDL_FORMAT_OPTIONS, FFMPEG_OPTIONS
+from config import (
+    FFMPEG_OPTIONS,
+    STREAM_EXPIRY_MARGIN,
+    STREAM_FALLBACK_TTL,
+    PLAYLIST_BATCH_SIZE,
+    DEFAULT_AUDIO_MODE,
+    DEFAULT_VOLUME,
+)
+from audio_cache import audio_cache
+from audio_workers import WorkerOpusAudio
+from extraction_service import extraction_service, get_ytdl
+from metrics import metrics
+from search_index import SearchIndex
+from track import Track
+from track_cache import TrackCache, STREAM_FIELDS
 
-# Inizializza yt-dlp
-ytdl = yt_dlp.YoutubeDL(YTDL_FORMAT_OPTIONS)
+# Cache condivisa di metadati e stream
+track_cache = TrackCache()
+# Indice delle ricerche già risolte, costruito dalla cache alla prima ricerca
+search_index = SearchIndex(loader=track_cache.known_tracks)
 
-# Configurazione specifica per playlist
-ytdl_playlist_options = YTDL_FORMAT_OPTIONS.copy()
-ytdl_playlist_options['noplaylist'] = False
-ytdl_playlist = yt_dlp.YoutubeDL(ytdl_playlist_options)
+# Durata di un frame audio inviato a Discord (secondi)
+FRAME_SECONDS = discord.opus.Encoder.FRAME_LENGTH / 1000
 
-class YTDLSource(discord.PCMVolumeTransformer):
-    def __init__(self, source, *, data, volume=0.5):
-        super().__init__(source, volume)
+class PositionTracker:
+    """Calcola la posizione dai frame effettivamente letti dal player audio.
+
+    In pausa il player non legge: la posizione non deriva dall'orologio.
+    """
+
+    offset = 0  # secondi da cui è partito FFmpeg
+    frames = 0
+
+    def read(self):
+        data = super().read()
+        if data:
+            self.frames += 1
+        return data
+
+    @property
+    def position(self):
+        return self.offset + self.frames * FRAME_SECONDS
+
+class TrackSource(PositionTracker):
+    """Parte comune delle sorgenti: metadati della traccia, volume e posizione"""
+
+    live_volume = False  # il volume si può cambiare durante la riproduzione
+
+    def _init_track(self, data, volume, offset):
         self.data = data
         self.title = data.get('title')
         self.thumbnail = data.get('thumbnail')
         self.duration = data.get('duration', 0)
+        self.volume = volume
+        self.offset = offset
+
+def opus_input(song_info, volume, offset=0):
+    """Input e opzioni FFmpeg per un'uscita Opus con il volume applicato da FFmpeg.
+
+    Se il formato è già Opus e il volume è pieno i pacchetti vengono copiati
+    senza ricodificare. Restituisce (sorgente, before_options, options, passthrough).
+    """
+    source, options, acodec = ffmpeg_input(song_info, offset)
+    passthrough = acodec == 'opus' and volume == 1.0
+    output_options = options['options']
+    if not passthrough:
+        output_options = f"{output_options} -af volume={volume}"
+    return source, options.get('before_options', ''), output_options, passthrough
+
+class YTDLSource(TrackSource, discord.PCMVolumeTransformer):
+    live_volume = True
+
+    def __init__(self, source, *, data, volume=DEFAULT_VOLUME, offset=0):
+        super().__init__(source, volume)
+        self._init_track(data, volume, offset)
+
+    @classmethod
+    async def from_url(
+        cls,
+        url,
+        *,
+        loop=None,
+        song_info=None,
+        audio_mode=DEFAULT_AUDIO_MODE,
+        volume=DEFAULT_VOLUME,
+        offset=0,
+    ):
+        """Crea la sorgente audio, riusando lo stream già risolto se ancora valido"""
+        song_info = song_info if song_info is not None else Track(url)
+        with metrics.timer('from_url'):
+            await resolve_stream(song_info)
+            return cls.from_resolved(
+                song_info, audio_mode=audio_mode, volume=volume, offset=offset
+            )
 
     @classmethod
-    async def from_url(cls, url, *, loop=None):
-        loop = loop or asyncio.get_event_loop()
-        data = await loop.run_in_executor(None, lambda: ytdl.extract_info(url, download=False))
-        
-        if 'entries' in data:
-            data = data['entries'][0]
-        
-        return cls(discord.FFmpegPCMAudio(data['url'], **FFMPEG_OPTIONS), data=data)
-
-async def extract_song_info(search_query):
-    """Estrae le informazioni della canzone da una query di ricerca"""
-    if not search_query.startswith('http'):
-        search_query = f"ytsearch:{search_query}"
+    def from_resolved(
+        cls,
+        song_info,
+        *,
+        audio_mode=DEFAULT_AUDIO_MODE,
+        volume=DEFAULT_VOLUME,
+        offset=0,
+    ):
+        """Avvia FFmpeg su una traccia già risolta, senza estrazione.
+
+        Con `offset` FFmpeg parte da quel secondo (seek sull'input).
+        """
+        with metrics.timer('ffmpeg_start'):
+            if audio_mode == 'worker':
+                try:
+                    source = YTDLWorkerSource(song_info, volume=volume, offset=offset)
+                    metrics.inc('ffmpeg_spawns_total', mode='worker')
+                    return source
+                except Exception as e:
+                    metrics.error('ffmpeg_start', e)
+                    print(f"Worker audio non disponibili, uso Opus: {e}")
+                    audio_mode = 'opus'
+
+            if audio_mode == 'opus':
+                try:
+                    source = YTDLOpusSource(song_info, volume=volume, offset=offset)
+                    metrics.inc('ffmpeg_spawns_total', mode='opus')
+                    return source
+                except Exception as e:
+                    metrics.error('ffmpeg_start', e)
+                    print(f"Sorgente Opus non disponibile, uso PCM: {e}")
+
+            source, options, _ = ffmpeg_input(song_info, offset)
+            audio = discord.FFmpegPCMAudio(source, **options)
+            metrics.inc('ffmpeg_spawns_total', mode='pcm')
+            return cls(audio, data=song_info, volume=volume, offset=offset)
+
+class YTDLOpusSource(TrackSource, discord.FFmpegOpusAudio):
+    """Sorgente Opus: FFmpeg applica il volume e codifica, senza elaborazione PCM in Python"""
+
+    def __init__(self, song_info, *, volume=DEFAULT_VOLUME, offset=0):
+        source, before_options, options, passthrough = opus_input(song_info, volume, offset)
+        super().__init__(
+            source,
+            before_options=before_options,
+            options=options,
+            codec='copy' if passthrough else None,
+        )
+        self._init_track(song_info, volume, offset)
+
+class YTDLWorkerSource(TrackSource, WorkerOpusAudio):
+    """Sorgente Opus prodotta da un worker audio: nel bot arrivano solo i pacchetti"""
+
+    def __init__(self, song_info, *, volume=DEFAULT_VOLUME, offset=0):
+        source, before_options, options, passthrough = opus_input(song_info, volume, offset)
+        super().__init__(
+            source,
+            before_options=before_options,
+            options=options,
+            codec='copy' if passthrough else 'libopus',
+        )
+        self._init_track(song_info, volume, offset)
+
+def parse_stream_expiry(stream_url):
+    """Estrae la scadenza (epoch) dall'URL dello stream, se presente"""
+    parsed = urlparse(stream_url)
+    expire = parse_qs(parsed.query).get('expire', [None])[0]
+
+    # Alcuni URL googlevideo hanno i parametri nel path (/expire/123/...)
+    if expire is None:
+        parts = parsed.path.split('/')
+        if 'expire' in parts:
+            index = parts.index('expire') + 1
+            expire = parts[index] if index < len(parts) else None
+
+    try:
+        return int(expire) if expire else None
+    except ValueError:
+        return None
+
+def is_stream_valid(song_info, margin=STREAM_EXPIRY_MARGIN):
+    """Controlla se lo stream risolto è ancora utilizzabile"""
+    if not song_info.get('stream_url') or not song_info.get('expires_at'):
+        return False
+    return song_info['expires_at'] - margin > time.time()
+
+def ffmpeg_options(http_headers=None):
+    """Opzioni FFmpeg con gli header HTTP richiesti dallo stream"""
+    options = FFMPEG_OPTIONS.copy()
+    if http_headers:
+        headers = ''.join(f'{key}: {value}\r\n' for key, value in http_headers.items())
+        options['before_options'] = f"{options['before_options']} -headers {shlex.quote(headers)}"
+    return options
+
+def ffmpeg_input(song_info, offset=0):
+    """Sorgente, opzioni FFmpeg e codec: il file in cache se presente, altrimenti lo stream"""
+    local_path = audio_cache.lookup(song_info.get('id'))
+    if local_path:
+        source, options, acodec = local_path, {'options': FFMPEG_OPTIONS['options']}, 'opus'
+    else:
+        if not song_info.get('stream_url'):
+            raise Exception("Nessuno stream audio disponibile")
+        options = ffmpeg_options(song_info.get('http_headers'))
+        source, acodec = song_info['stream_url'], song_info.get('acodec')
+
+    if offset:
+        # -ss prima dell'input: FFmpeg salta direttamente alla posizione
+        before = options.get('before_options', '')
+        options['before_options'] = f"{before} -ss {offset:.3f}".strip()
+    return source, options, acodec
+
+def song_from_data(data):
+    """Converte il risultato di yt-dlp in una traccia risolta"""
+    stream_url = data.get('url')
+    song = Track(
+        data.get('webpage_url') or stream_url,
+        title=data.get('title', 'Titolo sconosciuto'),
+        id=data.get('id'),
+        thumbnail=data.get('thumbnail'),
+        duration=data.get('duration'),
+    )
+
+    # Gli elementi flat hanno solo la lista delle miniature
+    if not song['thumbnail'] and data.get('thumbnails'):
+        song['thumbnail'] = data['thumbnails'][-1].get('url')
+
+    # Con le informazioni complete 'url' è lo stream del formato scelto
+    if stream_url and data.get('webpage_url') and stream_url != data['webpage_url']:
+        song['stream_url'] = stream_url
+        song['http_headers'] = data.get('http_headers') or {}
+        song['acodec'] = data.get('acodec')
+        song['expires_at'] = (
+            parse_stream_expiry(stream_url) or time.time() + STREAM_FALLBACK_TTL
+        )
+
+    return song
+
+async def resolve_stream(song_info, force=False):
+    """Garantisce che la traccia abbia uno stream valido, riestraendolo solo se scaduto.
+
+    Con force=True lo riestrae comunque (stream in scadenza o rifiutato).
+    """
+    if audio_cache.contains(song_info.get('id')):
+        return song_info
+    if not force and is_stream_valid(song_info):
+        return song_info
+
+    cached = None if force else await track_cache.get_stream(song_info['url'])
+    if cached:
+        song_info.update(cached)
+        return song_info
+
+    data = await extraction_service.extract(song_info['url'])
+
+    if 'entries' in data:
+        data = data['entries'][0]
+
+    resolved = song_from_data(data)
+    for field in STREAM_FIELDS:
+        song_info[field] = resolved[field]
+    # Le tracce flat non hanno sempre durata e miniatura
+    for key in ('id', 'title', 'thumbnail', 'duration'):
+        if not song_info.get(key):
+            song_info[key] = resolved[key]
+
+    if not song_info['stream_url']:
+        raise Exception("Nessuno stream audio disponibile")
+
+    track_cache.put_song(song_info['url'], song_info)
+    return song_info
+
+async def extract_song_info(search_query, force=False):
+    """Estrae le informazioni della canzone da una query di ricerca.
+
+    Con force=True ignora cache e indice e ripete sempre la ricerca.
+    """
+    with metrics.timer('extract_song_info'):
+        return await _extract_song_info(search_query, force)
+
+async def _extract_song_info(search_query, force=False):
+    if not force:
+        cached = await track_cache.get_song(search_query)
+        if cached:
+            return cached
+        if not search_query.startswith('http'):
+            cached = await _lookup_index(search_query)
+            if cached:
+                return cached
+
+    query = search_query
+    if not query.startswith('http'):
+        query = f"ytsearch:{query}"
     
-    loop = asyncio.get_event_loop()
-    data = await loop.run_in_executor(None, lambda: ytdl.extract_info(search_query, download=False))
+    data = await extraction_service.extract(query)
     
     if 'entries' in data:
         data = data['entries'][0]
     
-    return {
-        'url': data['webpage_url'],
-        'title': data.get('title', 'Titolo sconosciuto'),
-        'thumbnail': data.get('thumbnail'),
-        'duration': data.get('duration', 0)
-    }
+    song = song_from_data(data)
+    track_cache.put_song(search_query, song)
+    search_index.add_track(search_query, song)
+    return song
 
-async def extract_playlist_info(url):
-    """Estrae le informazioni di una playlist da un URL"""
+async def _lookup_index(search_query):
+    """Traccia di una ricerca quasi identica già risolta, senza chiamate di rete"""
+    await search_index.load()
+    match = search_index.lookup(search_query)
+    if match is None:
+        return None
+    # Non diventa una chiave esatta: una corrispondenza sbagliata non si ripete
+    # dopo una nuova ricerca della stessa query
+    return await track_cache.get_song(match['url']) or Track.from_dict(match)
+
+async def search_candidates(query, count):
+    """Cerca `count` risultati con un'unica ricerca flat, senza risolvere gli stream"""
+    with metrics.timer('search_candidates'):
+        data = await extraction_service.extract(f"ytsearch{count}:{query}", profile='flat')
+    return [song_from_data(entry) for entry in data.get('entries') or [] if entry]
+
+async def iter_playlist_info(url, batch_size=PLAYLIST_BATCH_SIZE):
+    """Estrae una playlist in modalità flat, restituendo le canzoni a blocchi"""
     loop = asyncio.get_event_loop()
-    
+    batches = asyncio.Queue()
+    stop = threading.Event()
+
+    def emit(item):
+        loop.call_soon_threadsafe(batches.put_nowait, item)
+
+    def worker():
+        try:
+            # process=False lascia le pagine della playlist come generatore
+            ytdl_flat = get_ytdl('flat')
+            data = ytdl_flat.extract_info(url, download=False, process=False)
+            if data.get('_type') in ('url', 'url_transparent'):
+                data = ytdl_flat.extract_info(url, download=False)
+
+            if 'entries' not in data:
+                # Non è una playlist, restituisce una singola canzone
+                data = get_ytdl().extract_info(url, download=False)
+                emit([song_from_data(data)])
+                return
+
+            batch = []
+            for entry in data['entries']:
+                if stop.is_set():
+                    return
+                if entry:  # Alcuni entry potrebbero essere None
+                    batch.append(song_from_data(entry))
+                if len(batch) >= batch_size:
+                    emit(batch)
+                    batch = []
+            if batch:
+                emit(batch)
+        except Exception as e:
+            emit(e)
+        finally:
+            emit(None)
+
+    extraction_service.run_playlist_walk(worker)
+
     try:
-        # Usa la configurazione che permette l'estrazione di playlist
-        data = await loop.run_in_executor(None, lambda: ytdl_playlist.extract_info(url, download=False))
-        
-        if 'entries' not in data:
-            # Non è una playlist, restituisce una singola canzone
-            return [{
-                'url': data['webpage_url'],
-                'title': data.get('title', 'Titolo sconosciuto'),
-                'thumbnail': data.get('thumbnail'),
-                'duration': data.get('duration', 0)
-            }]
-        
-        # È una playlist, estrae tutte le canzoni
-        songs = []
-        for entry in data['entries']:
-            if entry:  # Alcuni entry potrebbero essere None
-                songs.append({
-                    'url': entry['webpage_url'],
-                    'title': entry.get('title', 'Titolo sconosciuto'),
-                    'thumbnail': entry.get('thumbnail'),
-                    'duration': entry.get('duration', 0)
-                })
-        
-        return songs
-        
-    except Exception as e:
-        raise Exception(f"Errore nell'estrazione della playlist: {str(e)}")
+        while True:
+            item = await batches.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise Exception(f"Errore nell'estrazione della playlist: {str(item)}")
+            yield item
+    finally:
+        stop.set()
+
+async def extract_playlist_info(url):
+    """Estrae le informazioni di una playlist da un URL"""
+    songs = []
+    async for batch in iter_playlist_info(url):
+        songs.extend(batch)
+    return songs
 
 def is_playlist_url(url):
     """Controlla se un URL è una playlist"""
@@ -86,4 +385,4 @@ def is_playlist_url(url):
         'playlist?list=',
         '/playlist?'
     ]
-    return any(indicator in url.lower() for indicator in playlist_indicators)
\ No newline at end of file
+    return any(indicator in url.lower() for indicator in playlist_indicators)